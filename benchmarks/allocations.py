@@ -0,0 +1,80 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the memory allocated by the evaluation of set literals and set
+comprehensions, constant or depending on the context.
+
+Two quantities are reported per evaluation: the blocks still allocated once
+the evaluation is done, while its result is kept alive (e.g. a new set and its
+context), and the peak of the memory allocated during the evaluation, which
+also accounts for temporary objects such as generators and contexts.
+"""
+
+import tracemalloc
+
+from yaffel.datatypes import Enumeration
+from yaffel.parser import compile
+
+def retained(evaluate, number):
+    # keep the results alive, so that the blocks they hold are counted
+    results = []
+    evaluate()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for _ in range(number):
+            results.append(evaluate())
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    # the list holding the results isn't allocated by the evaluations
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(s.count_diff for s in stats if s.count_diff > 0 and s.traceback[0].filename != __file__)
+    return blocks / number
+
+def peak(evaluate, number):
+    evaluate()
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(number):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            evaluate()
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total / number
+
+def run(number=1000):
+    domain = Enumeration(range(100))
+    cases = [
+        ('enumeration', '{1, 2, 3}', {}),
+        ('range', '{0:10}', {}),
+        ('bound range', '{a:b}', {'a': 0, 'b': 10}),
+        ('comprehension', '{x * k for x in D}', {'k': 2, 'D': domain}),
+    ]
+
+    for name, source, context in cases:
+        set_expr = compile(source).expr
+        evaluate = lambda: set_expr(**context)
+        print('%-15s %8.1f blocks retained/eval %10.1f B peak/eval' %
+              (name, retained(evaluate, number), peak(evaluate, number)))
+
+if __name__ == '__main__':
+    run()
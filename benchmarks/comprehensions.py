@@ -0,0 +1,62 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the planned evaluation of set comprehensions with the naive one,
+which evaluates the whole function for every combination of the values of the
+bound variables.
+
+Pass the size of the domains on the command line, e.g.
+`python -m benchmarks.comprehensions 200`.
+"""
+
+import sys
+import time
+
+from yaffel.datatypes import Enumeration
+from yaffel.parser import compile
+from yaffel.planner import Planner
+
+BENCHMARKS = [
+    ('2 vars, filter', '{x + y if x < 10 and y < 10 for x in S, y in T}'),
+    ('2 vars, join', '{x + y if x == y + 1 for x in S, y in T}'),
+    ('3 vars, filter', '{x + y + z if x < 5 and y < 5 and z < 5 for x in S, y in T, z in U}'),
+    ('3 vars, join', '{x if x == y and y == z for x in S, y in T, z in U}'),
+]
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return result, time.perf_counter() - start
+
+def run(size=100):
+    bindings = {
+        'S': Enumeration(range(size)),
+        'T': Enumeration(range(0, size * 2, 2)),
+        'U': Enumeration(range(size // 2)),
+    }
+    for name, source in BENCHMARKS:
+        s = compile(source)(**bindings)
+        planner = Planner(s.function, s.context)
+
+        planned, t_planned = timed(lambda: planner.planned(s.context, s.scope))
+        naive, t_naive = timed(lambda: planner.naive(s.context, s.scope))
+        assert set(planned) == set(naive)
+        print('%-15s n=%-5i  planned %8.3f s  naive %8.3f s  (%i elements)' %
+              (name, size, t_planned, t_naive, len(set(planned))))
+
+if __name__ == '__main__':
+    run(*[int(n) for n in sys.argv[1:]])
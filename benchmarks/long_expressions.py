@@ -0,0 +1,58 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how parsing and evaluation scale with the length of an expression.
+
+Each shape is built with 10^3 to 10^5 terms, then compiled, printed, renamed
+and evaluated. Every step should grow linearly and none should hit the
+interpreter's recursion limit, however deep the expression is nested.
+
+Pass the sizes to measure on the command line, e.g.
+`python -m benchmarks.long_expressions 1000 10000`.
+"""
+
+import sys
+import time
+
+from yaffel.datatypes import Name, rename
+from yaffel.parser import compile
+
+SHAPES = [
+    ('flat', lambda n: ' + '.join(['x'] * n)),
+    ('left', lambda n: '(' * n + 'x' + ' + x)' * n),
+    ('right', lambda n: 'x + (' * n + 'x' + ')' * n),
+    ('if', lambda n: '(0 if x == 0 else ' * n + 'x' + ')' * n),
+]
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return result, time.perf_counter() - start
+
+def run(sizes=(1000, 10000, 100000)):
+    for n in sizes:
+        for name, shape in SHAPES:
+            source = shape(n)
+            expr, t_compile = timed(lambda: compile(source))
+            _, t_str = timed(lambda: str(expr))
+            _, t_rename = timed(lambda: rename(expr.expr, {'x': Name('y')}))
+            _, t_eval = timed(lambda: expr(x=1))
+            print('%-5s n=%-6i  compile %8.3f s  str %7.3f s  rename %7.3f s  eval %7.3f s' %
+                  (name, n, t_compile, t_str, t_rename, t_eval))
+
+if __name__ == '__main__':
+    run([int(n) for n in sys.argv[1:]] or (1000, 10000, 100000))
@@ -0,0 +1,47 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures repeated membership tests in a set comprehension, as when the
+test is evaluated for every row of a batch, with and without a
+materialization cache.
+"""
+
+import timeit
+
+from yaffel.datatypes import Enumeration
+from yaffel.parser import compile
+from yaffel.planner import MaterializationCache, use_cache
+
+def run(size=10000, rows=200):
+    expr = compile('v in {x * x + k for x in D}')
+    domain = Enumeration(range(size))
+    evaluate = lambda: [expr(v=v, k=1, D=domain) for v in range(rows)]
+
+    use_cache(None)
+    t = timeit.timeit(evaluate, number=1) / rows
+    print('no cache    %10.3f ms/row' % (t * 1000))
+
+    cache = MaterializationCache()
+    use_cache(cache)
+    try:
+        t = timeit.timeit(evaluate, number=1) / rows
+    finally:
+        use_cache(None)
+    print('cache       %10.3f ms/row  %r' % (t * 1000, cache))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,46 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the evaluation time of expressions before and after they are
+rewritten by the type-directed optimizer.
+"""
+
+import timeit
+
+from yaffel.parser import CompiledExpression, compile, fold_brackets, program, tokenize
+
+BENCHMARKS = [
+    ('constant arithmetic', 'x * (2 ** 10 + 3 * 4 - 1)'),
+    ('enumeration membership', 'x in {1, 2, 3, 5, 8, 13, 21, 34, 55, 89}'),
+    ('range membership', 'x in {0:100}'),
+    ('annotated builtins', 'log(x) + sqrt(x)'),
+    ('constant condition', 'x + 1 if 1 < 2 else x - 1'),
+]
+
+def unoptimized(source):
+    return CompiledExpression(*program.parse(fold_brackets(tokenize(source))))
+
+def run(number=20000):
+    for name, source in BENCHMARKS:
+        times = []
+        for expr in (unoptimized(source), compile(source)):
+            times.append(timeit.timeit(lambda: expr(x=42), number=number) / number)
+        print('%-24s %8.2f us/eval  %8.2f us/eval optimized  (x%.1f)' %
+              (name, times[0] * 1e6, times[1] * 1e6, times[0] / times[1]))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,50 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the time saved per expression by a prelude of 50 definitions,
+compared to expressions that carry the same definitions in their context.
+
+Both variants are compiled then evaluated once, as in the shell, and again
+for the evaluation alone.
+"""
+
+import timeit
+
+from yaffel.parser import compile, read_prelude
+
+DEFINITIONS = ['f0 = [x: x + 1]'] + \
+    ['f%i = [x: f%i(x) * 2 if x < %i else x - %i]' % (i, i - 1, i, i) for i in range(1, 50)]
+
+EXPRESSIONS = ['f49(x)', 'f10(x) + f20(x)', 'f0(x) if x > 0 else f1(x)']
+
+def run(number=20):
+    t = timeit.timeit(lambda: read_prelude('\n'.join(DEFINITIONS)), number=1)
+    print('prelude loaded in %.3f ms' % (t * 1000))
+
+    prelude = read_prelude('\n'.join(DEFINITIONS))
+    context = ' for ' + ', '.join(DEFINITIONS)
+    for source in EXPRESSIONS:
+        inline = timeit.timeit(lambda: compile(source + context)(x=3), number=number) / number
+        shared = timeit.timeit(lambda: compile(source, prelude=prelude)(x=3), number=number) / number
+
+        expr = compile(source, prelude=prelude)
+        evaluation = timeit.timeit(lambda: expr(x=3), number=number) / number
+        print('%-26s  context %8.3f ms  prelude %8.3f ms  evaluation alone %8.3f ms' %
+              (source, inline * 1000, shared * 1000, evaluation * 1000))
+
+if __name__ == '__main__':
+    run()
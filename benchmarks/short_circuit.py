@@ -0,0 +1,62 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the work skipped by lazy evaluation of `and`, `or`, `in` and
+conditional expressions.
+
+Each benchmark evaluates an expression whose right operand is expensive
+(a recursive function application or a call to a counting builtin), once with
+a left operand that decides the result and once with one that doesn't.
+"""
+
+import timeit
+
+from yaffel.parser import compile
+
+FIB = 'fib = [n: n if n < 2 else fib(n - 1) + fib(n - 2)]'
+
+BENCHMARKS = [
+    ('and', 'x and fib(15) > 0 for ' + FIB),
+    ('or', 'x == 1 or fib(15) > 0 for ' + FIB),
+    ('in', '1 in {x, fib(15)} for ' + FIB),
+    ('if', 'fib(15) if x == 0 else 0 for ' + FIB),
+]
+
+class Counter(object):
+    """Builtin that counts how many times it has been called."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return 1
+
+def run(number=5):
+    for name, source in BENCHMARKS:
+        expr = compile(source)
+        counted = compile(source.replace('fib(15)', 'count()', 1))
+        for x in (1, 0):
+            count = Counter()
+            counted(x=x, count=count)
+
+            t = timeit.timeit(lambda: expr(x=x), number=number) / number
+            print('%-4s x=%i  %10.3f ms/eval  right operand evaluations: %i' %
+                  (name, x, t * 1000, count.calls))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,51 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the throughput of a single compiled expression shared by a pool of
+threads.
+
+Throughput only scales with the number of threads on free-threaded builds of
+python (i.e. with the GIL disabled); on other builds it is expected to stay
+roughly constant.
+"""
+
+import sys, time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from yaffel.parser import compile
+
+SOURCE = ('fp([x: x + 1 if x < n else n], k) + g(k) '
+          'for fp = [f, x: x if f(x) == x else fp(f, f(x))], '
+          'g = [v: 1 if v in {1, 3, 5} else 0]')
+
+def run(evaluations=4000):
+    expr = compile(SOURCE)
+    work = lambda i: expr(k=i % 7, n=10)
+
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('python %s, GIL %s' % (sys.version.split()[0], 'enabled' if gil else 'disabled'))
+
+    for threads in (1, 2, 4, 8):
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            start = time.perf_counter()
+            list(pool.map(work, range(evaluations), chunksize=evaluations // threads))
+            elapsed = time.perf_counter() - start
+        print('%i thread(s)  %10.0f evals/s' % (threads, evaluations / elapsed))
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,94 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array, csv, io, os, tempfile, unittest
+
+from contextlib import redirect_stderr
+
+from yaffel.batch import *
+from yaffel.exceptions import *
+from yaffel.parser import compile
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_read_csv(self):
+        path = self.write('in.csv', b'x,y\n1,2\n3,4\n5,6\n')
+        self.assertEqual(list(read_csv(path, chunk_size=2)),
+                         [['x', 'y'], [['1', '2'], ['3', '4']], [['5', '6']]])
+        self.assertEqual(list(read_csv(self.write('empty.csv', b''))), [])
+
+    def test_evaluate_csv(self):
+        path = self.write('in.csv', b'x,y,name\n1,2,a\n3,4.5,b\n5,6,c\n')
+        out = io.StringIO()
+        stats = evaluate_csv('x + y', path, out, chunk_size=2)
+        self.assertEqual(out.getvalue(), 'result\n3\n7.5\n11\n')
+        self.assertEqual(stats.rows, 3)
+
+        out = io.StringIO()
+        evaluate_csv(compile('name if x > 1 else k for k = "-"'), path, out, name='r')
+        self.assertEqual(out.getvalue(), 'r\n-\nb\nc\n')
+
+        self.assertRaises(EvaluationError, evaluate_csv, 'z', path, io.StringIO())
+
+        # rows with missing fields are reported with their number
+        path = self.write('ragged.csv', b'x,y\n1,2\n3\n')
+        with self.assertRaisesRegex(csv.Error, 'row 2'):
+            evaluate_csv('x + y', path, io.StringIO())
+        with redirect_stderr(io.StringIO()) as err:
+            self.assertEqual(main(['x + y', path]), -1)
+        self.assertIn('Invalid CSV input', err.getvalue())
+
+        # empty rows, such as those of trailing newlines, are skipped
+        out = io.StringIO()
+        path = self.write('trailing.csv', b'x,y\n1,2\n\n3,4\n\n\n')
+        self.assertEqual(evaluate_csv('x + y', path, out).rows, 2)
+        self.assertEqual(out.getvalue(), 'result\n3\n7\n')
+
+    def test_evaluate_columns(self):
+        x = self.write('x.bin', array.array('q', range(10)).tobytes())
+        y = self.write('y.bin', array.array('d', [0.5] * 10).tobytes())
+
+        out = io.BytesIO()
+        stats = evaluate_columns('x * y', {'x': (x, 'q'), 'y': (y, 'd')}, out,
+                                 chunk_size=3, typecode='d')
+        self.assertEqual(array.array('d', out.getvalue()).tolist(), [i * 0.5 for i in range(10)])
+        self.assertEqual(stats.rows, 10)
+
+        out = io.StringIO()
+        evaluate_columns('x in {1, 2}', {'x': (x, 'q')}, out)
+        self.assertEqual(out.getvalue().split(), ['False', 'True', 'True'] + ['False'] * 7)
+
+        # column types are known statically
+        self.assertRaises(TypeError, evaluate_columns, 'x < "a"', {'x': (x, 'q')},
+                          io.StringIO())
+        self.assertRaises(ValueError, evaluate_columns, 'x + y',
+                          {'x': (x, 'q'), 'y': (self.write('z.bin', b''), 'd')}, io.StringIO())
+
+if __name__ == '__main__':
+    unittest.main()
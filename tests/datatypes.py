@@ -0,0 +1,146 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from yaffel.datatypes import *
+from yaffel.datatypes import rename
+from yaffel.parser import compile, parse
+
+class TestDatatypes(unittest.TestCase):
+
+    def test_rename_variable(self):
+        expr = Expression([Name('x'), (lambda a,b: a + b, Name('y'))])
+        renamed = expr.rename_variable({'x': 1})
+        self.assertEqual(renamed(y=2), 3)
+
+        # the original expression is left unchanged
+        self.assertEqual(expr._unfolded_expr[0], Name('x'))
+        self.assertEqual(expr(x=2, y=2), 4)
+
+    def test_rename_shadowing(self):
+        f = AnonymousFunction([Name('x')], Expression([Name('x')]))
+        self.assertEqual(rename(f, {'x': 1})(2), 2)
+
+        s = Set(Name('x'), {'x': Name('y')})
+        renamed = rename(s, {'x': 1, 'y': Enumeration([1])})
+        self.assertEqual(renamed.function, Name('x'))
+        self.assertEqual(renamed.context['x'], Enumeration([1]))
+
+    def test_immutable_context(self):
+        f = AnonymousFunction([Name('x')], Expression([Name('x')]))
+        context = {'y': 1}
+        self.assertEqual(f(2, **context), 2)
+        self.assertEqual(context, {'y': 1})
+
+        expr = compile('x + y for y = 1')
+        with self.assertRaises(TypeError):
+            expr.context['y'] = 2
+
+    def test_interval_set(self):
+        a = Range(0, 10) - Enumeration([5])
+        self.assertIsInstance(a, IntervalSet)
+        self.assertEqual(a.intervals, ((0, 5, True, False), (5, 10, False, True)))
+        self.assertIn(0, a)
+        self.assertIn(4.5, a)
+        self.assertNotIn(5, a)
+        self.assertNotIn(10.5, a)
+        self.assertNotIn('a', a)
+
+        # adjacent intervals are merged, and results are simplified
+        self.assertEqual(a | Enumeration([5]), Range(0, 10))
+        self.assertEqual(Range(0, 1) | Range(1, 2), Range(0, 2))
+        self.assertEqual(Range(0, 2) & Range(1, 3), Range(1, 2))
+        self.assertEqual(Range(0, 1) & Range(1, 2), Enumeration([1]))
+        self.assertEqual(Range(0, 1) & Range(2, 3), Enumeration([]))
+        self.assertEqual(Enumeration([1, 2, 'a']) - Range(0, 1), Enumeration([2, 'a']))
+
+        b = ~Enumeration([1, 'a'])
+        self.assertIn(0, b)
+        self.assertIn('b', b)
+        self.assertNotIn(1, b)
+        self.assertNotIn('a', b)
+        self.assertEqual(~b, Enumeration([1, 'a']))
+        self.assertEqual(b & Enumeration(['a', 'b', 1, 2]), Enumeration(['b', 2]))
+
+        self.assertRaises(TypeError, lambda: Range(0, 1) | 1)
+        self.assertRaises(TypeError, lambda: Set(Name('x'), {'x': Range(0, 1)}) | Range(0, 1))
+
+        # interval sets are written in a form that can be parsed again
+        inf = float('inf')
+        for s in (a, b, a | Enumeration([20, 'x']), ~Range(0, 1) & Range(-1, 2),
+                  IntervalSet([(-inf, 1, False, True), (3, inf, True, False)], ['b'])):
+            self.assertEqual(parse(str(s))[1], s)
+        self.assertEqual(str(a), '({0:5} - {5}) | ({5:10} - {5})')
+
+    def test_evaluated_sets(self):
+        # constant and evaluated sets evaluate to themselves
+        for s in (Enumeration([1, 'a']), Range(0, 1), ~Enumeration([1])):
+            self.assertIs(s(), s)
+        s = Set(Name('x'), {'x': Range(0, 1)})()
+        self.assertIs(s(x=1), s)
+
+        # sets depending on the context reuse their evaluated form as long as
+        # the bindings they capture are the same objects
+        e = Enumeration([Name('a'), 1])
+        r = Range(Name('a'), Name('b'))
+        a, b = 1.5, 2.5
+        self.assertEqual(e(a=a), Enumeration([1.5, 1]))
+        self.assertIs(e(a=a), e(a=a))
+        self.assertIs(r(a=a, b=b), r(a=a, b=b, c=0))
+        self.assertEqual(e(a=2), Enumeration([2, 1]))
+        self.assertEqual(r(a=0, b=b), Range(0, 2.5))
+        self.assertRaises(TypeError, r, a=b, b=a)
+
+        s = compile('{x + k for x in D}').expr
+        d = Enumeration([1, 2])
+        first = s(D=d, k=1)
+        self.assertIs(s(D=d, k=1, v=0), first)
+        self.assertEqual(set(first), {2, 3})
+        self.assertEqual(set(s(D=d, k=2)), {3, 4})
+        self.assertEqual(set(s(D=Enumeration([0]), k=2)), {2})
+
+        # names unbound at the first evaluation are checked again
+        self.assertIsNot(s(D=d), s(D=d, k=1))
+        self.assertEqual(set(s(D=d, k=1)), {2, 3})
+
+        # domains are evaluated once per evaluation
+        calls = []
+        def f(n):
+            calls.append(n)
+            return Enumeration(range(n))
+        s = compile('{x for x in f(3)}').expr
+        s(f=f)
+        s(f=f)
+        self.assertEqual(calls, [3, 3])
+
+    def test_concurrent_evaluation(self):
+        expr = compile('fp([x: x + 1 if x < n else n], k) + g(k) '
+                       'for fp = [f, x: x if f(x) == x else fp(f, f(x))], '
+                       'g = [v: 1 if v in {1, 3, 5} else 0]')
+
+        def evaluate(i):
+            k, n = i % 7, 10 + i % 5
+            return expr(k=k, n=n) == n + (1 if k in (1, 3, 5) else 0)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            self.assertTrue(all(pool.map(evaluate, range(2000))))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numbers, unittest
+
+from yaffel.datatypes import *
+from yaffel.inference import *
+from yaffel.parser import compile, parse
+
+class TestInference(unittest.TestCase):
+
+    def test_literals(self):
+        self.assertEqual(compile('1').type, int)
+        self.assertEqual(compile('1.0').type, float)
+        self.assertEqual(compile('True').type, bool)
+        self.assertEqual(compile('"a"').type, str)
+        self.assertEqual(compile('{1, 2}').type, Set)
+        self.assertEqual(compile('{1:2}').type, Set)
+        self.assertEqual(compile('[x: x]').type, AnonymousFunction)
+
+    def test_operators(self):
+        self.assertEqual(compile('x + 1 for x = 2').type, int)
+        self.assertEqual(compile('x + 1 for x = 2.0').type, float)
+        self.assertEqual(compile('x / 1 for x = 2').type, float)
+        self.assertEqual(compile('x ** 2 for x = 2').type, numbers.Real)
+        self.assertEqual(compile('x < 1 for x = 2').type, bool)
+        self.assertEqual(compile('x and y').type, bool)
+        self.assertEqual(compile('x in {1}').type, bool)
+        self.assertEqual(compile('x + 1').type, None)
+        self.assertEqual(compile('{1, 2} | {1:3} - {x}').type, Set)
+        self.assertEqual(compile('~x for x = {1}').type, Set)
+        self.assertEqual(compile('x | y').type, Set)
+
+    def test_conditional(self):
+        self.assertEqual(compile('1 if x else 2').type, int)
+        self.assertEqual(compile('1 if x else 2.0').type, numbers.Real)
+        self.assertEqual(compile('1 if x else "a"').type, None)
+
+    def test_application(self):
+        self.assertEqual(compile('log(x)').type, float)
+        self.assertEqual(compile('abs(x) for x = 1').type, int)
+        self.assertEqual(compile('f(1) for f = [x: x + 1]').type, int)
+        self.assertEqual(compile('f(1.0) for f = [x: x + 1]').type, float)
+        self.assertEqual(compile('f(1) for f = [x: f(x)]').type, None)
+        self.assertEqual(compile('log(x) for log = [x: "a"]').type, str)
+        self.assertEqual(compile('max(1, 2.0)').type, numbers.Real)
+        self.assertEqual(parse('max("a", "b")'), (str, 'b'))
+        self.assertEqual(compile('min(x, y)')(x="a", y="b"), 'a')
+        self.assertEqual(compile('f(1) for f = [x: g(x)], g = [x: x + 1]').type, int)
+
+    def test_type_errors(self):
+        self.assertRaises(TypeError, compile, 'x + 1 for x = "a"')
+        self.assertRaises(TypeError, compile, 'x * y for x = "a", y = 1.5')
+        self.assertRaises(TypeError, compile, '"a" < 1')
+        self.assertRaises(TypeError, compile, '1 in 2')
+        self.assertRaises(TypeError, compile, 'log("a")')
+        self.assertRaises(TypeError, compile, '{x:2} for x = "a"')
+        self.assertRaises(TypeError, compile, '[x, y: x](1)')
+        self.assertRaises(TypeError, compile, '{1} | 2')
+        self.assertRaises(TypeError, compile, '~x for x = "a"')
+        self.assertRaises(TypeError, compile, '1 | 2')
+        self.assertRaises(TypeError, compile, 'x & 1.5')
+        self.assertRaises(TypeError, compile, '~1')
+
+        # errors are reported even if the erroneous branch isn't evaluated
+        self.assertRaises(TypeError, compile, '1 if True else x + 1 for x = "a"')
+
+    def test_constant_folding(self):
+        self.assertEqual(compile('1 + 2 * 3').expr, 7)
+        self.assertEqual(compile('1 + 2 + x')(x=1), 4)
+        self.assertEqual(compile('2 in {1, 2, 3}').expr, True)
+        self.assertEqual(compile('x if 1 < 2 else y').expr, Expression([Name('x')]))
+        self.assertRaises(ZeroDivisionError, parse, '(1 + 1) / 0')
+        self.assertEqual(parse('1 / 0 if False else 2'), (int, 2))
+
+    def test_membership(self):
+        expr = compile('x in {1, 2, 3}').expr
+        self.assertIsInstance(expr._unfolded_expr[1][0], MembershipTest)
+        self.assertEqual(compile('x in {1, 2, 3}')(x=2), True)
+        self.assertEqual(compile('x not in {1, 2, 3}')(x=2), False)
+        self.assertEqual(compile('x in {1:3}')(x=2.5), True)
+        self.assertEqual(compile('x in {1:3}')(x="a"), False)
+
+        expr = compile('x in {1:3} - {2}')
+        self.assertIsInstance(expr.expr._unfolded_expr[1][0], MembershipTest)
+        self.assertEqual([expr(x=x) for x in (1, 2, 2.5)], [True, False, True])
+
+    def test_builtin_guards(self):
+        expr = compile('log(x)')
+        self.assertIsInstance(expr.expr, BuiltinApplication)
+        self.assertEqual(expr(x=1), 0.0)
+        self.assertRaises(TypeError, expr, x="a")
+
+        # names bound at evaluation time shadow built-ins
+        self.assertEqual(expr(x=1, log=lambda x: "a"), "a")
+
+    def test_specialize(self):
+        expr = compile('a * x + f(b) if k > 0 else g(x) '
+                       'for f = [v: v * 2 + c], g = [v: v - 1], fib = [n: fib(n)]')
+        for bindings in ({'k': 1, 'a': 2, 'b': 3, 'c': 4}, {'k': 0}, {'a': 3, 'c': 1}):
+            residual = expr.specialize(**bindings)
+            for x in range(3):
+                args = {'k': 1, 'a': 1, 'b': 1, 'c': 1, 'x': x}
+                args.update(bindings)
+                self.assertEqual(residual(**args), expr(**args))
+
+        # constant branches are selected and functions are inlined
+        residual = expr.specialize(k=1, a=2, b=3, c=4)
+        self.assertEqual(residual.free_variables, {'x'})
+        self.assertEqual(residual.context, {})
+        self.assertEqual(residual(x=5), 20)
+        self.assertEqual(str(expr.specialize(k=0)), str(compile('x - 1').expr))
+
+        # recursive functions are kept in the context of the residual expression
+        residual = compile('fib(n) for fib = [n: n if n < 2 else fib(n - 1) + fib(n - 2)]'
+                           ).specialize(n=10)
+        self.assertEqual(set(residual.context), {'fib'})
+        self.assertEqual(residual(), 55)
+
+        # arguments aren't substituted where they would be captured
+        residual = compile('f(y) for f = [v: {v + y for y in S}]').specialize()
+        self.assertEqual(set(residual(S={1, 2}, y=10)), {11, 12})
+
+        # definitions that become constant are folded into the expression
+        residual = compile('x + c for c = k * 2').specialize(k=1)
+        self.assertEqual(residual.context, {})
+        self.assertEqual(str(residual), str(compile('x + 2').expr))
+        residual = compile('x if mode == 1 else y for mode = m').specialize(m=1)
+        self.assertEqual(residual.context, {})
+        self.assertEqual(residual.free_variables, {'x'})
+
+        # anonymous functions applied in place see the same bindings as named ones
+        expr = compile('[x: x + y](2)')
+        self.assertEqual(expr(y=1), 3)
+        self.assertEqual(expr.specialize(y=1).expr, 3)
+
+        self.assertEqual(compile('sqrt(a) + x').specialize(a=4).expr._unfolded_expr[0], 2.0)
+        self.assertRaises(TypeError, compile('log(a)').specialize, a="a")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,7 +19,7 @@ import math, unittest
 
 from yaffel.datatypes import *
 from yaffel.exceptions import *
-from yaffel.parser import parse
+from yaffel.parser import parse, compile, read_prelude, share_prelude
 
 class TestParser(unittest.TestCase):
 
@@ -138,6 +138,22 @@ class TestParser(unittest.TestCase):
         self.assertRaises(TypeError, parse, '{1:1}')
         self.assertRaises(SyntaxError, parse, '{1:{1:2}}')
 
+    def test_set_algebra(self):
+        self.assertEqual(parse('{1:5} & {3:9}'), (Range, Range(3,5)))
+        self.assertEqual(parse('{1:2} | {2:3} | {6:7} & {0:5}'), (Range, Range(1,3)))
+        self.assertEqual(parse('{1, 2, 3} - {2}'), (Enumeration, Enumeration([1,3])))
+        self.assertEqual(parse('3 in {1:5} - {3}'), (bool, False))
+        self.assertEqual(parse('x in ~S for S = {1:5}, x = 0'), (bool, True))
+        self.assertEqual(parse('x in S | T for S = {1:3}, T = {5}, x = 5'), (bool, True))
+        self.assertEqual(parse('x - 1 for x = 3'), (int, 2))
+
+        t, s = parse('{1:5} - {3} | {"a"}')
+        self.assertEqual(t, IntervalSet)
+        self.assertEqual([x in s for x in (1, 3, 4.5, 5.5, "a")], [True, False, True, False, True])
+
+        self.assertRaises(TypeError, parse, '{1:5} - 2')
+        self.assertRaises(TypeError, parse, '{x for x in {1:2}} | {2}')
+
     def test_set_expression(self):
         t, s = parse('{x for x in {}}')
         self.assertEqual(t, Set)
@@ -170,5 +186,97 @@ class TestParser(unittest.TestCase):
         self.assertRaises(EvaluationError, parse, 'g(x)')
         self.assertRaises(TypeError, parse, '[x, y: x](1)')
 
+    def test_short_circuit(self):
+        calls = []
+        def f(x):
+            calls.append(x)
+            return x
+
+        self.assertEqual(compile('False and f(1)')(f=f), False)
+        self.assertEqual(compile('True or f(1)')(f=f), True)
+        self.assertEqual(compile('x > 0 and f(x) > 0')(x=-1, f=f), False)
+        self.assertEqual(compile('1 in {1, f(2)}')(f=f), True)
+        self.assertEqual(compile('1 not in {1, f(2)}')(f=f), False)
+        self.assertEqual(compile('f(1) if True else f(2)')(f=f), 1)
+        self.assertEqual(compile('f(1) if False else f(2)')(f=f), 2)
+        self.assertEqual(calls, [1, 2])
+
+        del calls[:]
+        self.assertEqual(compile('True and f(1)')(f=f), True)
+        self.assertEqual(compile('False or f(0)')(f=f), False)
+        self.assertEqual(compile('3 in {1, f(2)}')(f=f), False)
+        self.assertEqual(calls, [1, 0, 2])
+
+        # the right operand is not evaluated, even if it can't be bound
+        self.assertEqual(parse('False and x'), (bool, False))
+        self.assertEqual(parse('True or x'), (bool, True))
+        self.assertRaises(EvaluationError, parse, 'True and x')
+
+    def test_long_expressions(self):
+        n = 5000
+        self.assertEqual(parse(' + '.join(['1'] * n)), (int, n))
+        self.assertEqual(parse('(' * n + '1' + ' + 1)' * n), (int, n + 1))
+        self.assertEqual(parse('1 + (' * n + '1' + ')' * n), (int, n + 1))
+
+        nested = '(0 if x == 0 else ' * n + 'x' + ')' * n
+        self.assertEqual(compile(nested)(x=3), 3)
+        self.assertEqual(str(compile(' + '.join(['x'] * n))).count('x'), n)
+
+        # deeply nested terms are hashed, compared and written without recursion
+        left = '(' * n + 'x' + ' + x)' * n
+        self.assertEqual(compile('{%s, 1}' % left)(x=1), Enumeration([n + 1, 1]))
+        self.assertEqual(compile(left).expr, compile(left).expr)
+        self.assertEqual(str(compile(left)).count('x'), n + 1)
+
+        applied = 'f(' * n + '5' + ')' * n
+        self.assertEqual(compile('{%s, 1}' % applied)(f=abs), Enumeration([5, 1]))
+        self.assertEqual(compile(applied).expr, compile(applied).expr)
+        self.assertNotEqual(compile(applied).expr, compile('f(' + applied + ')').expr)
+        self.assertEqual(hash(compile('[x: %s]' % applied).expr),
+                         hash(compile('[x: %s]' % applied).expr))
+
+        self.assertEqual(parse('(1 if True else 2) + 1'), (int, 2))
+        self.assertRaises(SyntaxError, parse, '(1 + 2')
+        self.assertRaises(SyntaxError, parse, '1 + 2)')
+        self.assertRaises(SyntaxError, parse, '{1, 2)')
+
+    def test_prelude(self):
+        prelude = read_prelude('''
+            # helpers
+            double = [x: x * 2]
+            quad = [x: double(double(x))]
+            ten = 10
+        ''')
+        self.assertEqual(len(prelude), 3)
+        self.assertEqual(parse('quad(ten)', prelude=prelude), (int, 40))
+        self.assertEqual(compile('quad(x)', prelude=prelude).type, None)
+        self.assertEqual(compile('quad(x)', prelude=prelude).free_variables, {'x'})
+
+        # the context of an expression shadows the prelude
+        self.assertEqual(parse('quad(1) for double = [x: x]', prelude=prelude), (int, 1))
+        self.assertEqual(compile('quad(x)', prelude=prelude).specialize(x=1).expr, 4)
+
+        # the prelude is looked up rather than copied into each evaluation
+        s = compile('{quad(x) for x in {1, 2}}', prelude=prelude)()
+        self.assertIs(s.scope.maps[-1], prelude.definitions)
+        self.assertEqual(set(s), {4, 8})
+
+        # so are the bindings given when the expression is evaluated
+        self.assertEqual(compile('ten', prelude=prelude)(ten=1), 1)
+        self.assertEqual(compile('quad(ten)', prelude=prelude)(double=abs), 10)
+        self.assertEqual(compile('ten for ten = 2', prelude=prelude)(ten=1), 2)
+        self.assertEqual(compile('quad(ten)', prelude=prelude).specialize(ten=1)(), 4)
+
+        share_prelude(prelude)
+        try:
+            self.assertEqual(parse('double(ten)'), (int, 20))
+        finally:
+            share_prelude(None)
+        self.assertRaises(EvaluationError, parse, 'double(ten)')
+
+        self.assertRaises(SyntaxError, read_prelude, 'f = ')
+        self.assertRaises(EvaluationError, read_prelude, 'f = 1\nf = 2')
+        self.assertRaises(TypeError, read_prelude, 'f = log("a")')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,142 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from yaffel.datatypes import *
+from yaffel.exceptions import *
+from yaffel.parser import compile, parse
+from yaffel.planner import MaterializationCache, Planner, conjuncts, use_cache
+
+class TestPlanner(unittest.TestCase):
+
+    def test_conjuncts(self):
+        condition = compile('x > 1 and y < 2 and (x == y and z)').expr
+        self.assertEqual([str(c) for c in conjuncts(condition)],
+                         [str(compile(c).expr) for c in ('x > 1', 'y < 2', 'x == y', 'z')])
+        self.assertEqual(len(conjuncts(compile('x > 1 or y < 2').expr)), 1)
+
+    def test_plan(self):
+        s = compile('{x + y if x == y and x > 1 and x + y < z for x in S, y in T}').expr
+        planner = Planner(s.function, s.context)
+        steps = planner.plan({'x': [(1, ()), (2, ())], 'y': [(1, ()), (2, ()), (3, ())]}, {})
+
+        # the smallest domain is scanned first, and the other one is joined
+        self.assertEqual([(n, k is not None) for n,_,k,_ in steps], [('x', False), ('y', True)])
+        self.assertEqual(steps[1][1], {1: [(1, ())], 2: [(2, ())], 3: [(3, ())]})
+        self.assertEqual(len(steps[1][3]), 1)
+
+    def test_elements(self):
+        self.assertEqual(set(parse('{x * y for x in {1, 2, 3}, y in {10, 20}}')[1]),
+                         {10, 20, 30, 40, 60})
+        self.assertEqual(set(parse('{x + y if x == y and x > 1 for x in {1, 2, 3}, y in {2, 3, 4}}')[1]),
+                         {4, 6})
+        self.assertEqual(set(parse('{x if y == x + 1 and z == y + 1 '
+                                   'for x in {1, 2, 3}, y in {2, 4}, z in {3, 5, 6}}')[1]),
+                         {1, 3})
+        self.assertEqual(set(parse('{x if k > 0 for x in {1, 2}} for k = 0')[1]), set())
+        self.assertEqual(set(parse('{x + k for x in {1, 2}} for k = 10')[1]), {11, 12})
+        self.assertEqual(parse('4 in {x * 2 for x in {1, 2}}'), (bool, True))
+        self.assertEqual(parse('{x for x in {1, 2}} | {5}'), (Enumeration, Enumeration([1, 2, 5])))
+        self.assertRaises(TypeError, set, parse('{x for x in {1:2}}')[1])
+
+    def test_pushdown(self):
+        calls = []
+        def f(x):
+            calls.append(x)
+            return x > 1
+
+        s = compile('{x + y if f(x) and x < y for x in {1, 2, 3}, y in {1, 2, 3, 4}}')(f=f)
+        self.assertEqual(set(s), {5, 6, 7})
+        self.assertEqual(sorted(calls), [1, 2, 3])
+
+    def test_short_circuit(self):
+        # log(0) would only be computed if some x was greater than 5, so the
+        # conjuncts have to be evaluated in the order they were written
+        self.assertEqual(set(parse('{y if x > 5 and log(y) > 0 for x in {1, 2}, y in {0, 1}}')[1]),
+                         set())
+        self.assertRaises(ValueError, set,
+                          parse('{y if x > 1 and log(y) > 0 for x in {1, 2}, y in {0, 1}}')[1])
+
+    def test_deferred_errors(self):
+        calls = []
+        def f(x):
+            calls.append(x)
+            return x > 1
+
+        # errors of the conjuncts checked ahead of their turn are only raised
+        # if the conjunct is reached, without enumerating the set again
+        s = compile('{y if f(x) and log(y) > 0 for x in X, y in {0, 2}}')
+        self.assertEqual(set(s(f=f, X=Enumeration([1]))), set())
+        self.assertRaises(ValueError, set, s(f=f, X=Enumeration([1, 2])))
+        self.assertEqual(calls, [1, 1, 2])
+
+        del calls[:]
+        s = compile('{x if f(x) and g(x) for x in {1, 2}}')(f=f)
+        self.assertRaises(EvaluationError, set, s)
+        self.assertEqual(sorted(calls), [1, 2])
+
+        # joins on unhashable values fall back to the condition
+        s = compile('{y if l(x) == y for x in {1, 2}, y in {1, 2, 3}}')(l=lambda x: [x])
+        self.assertEqual(set(s), set())
+
+    def test_hidden_errors(self):
+        # bindings pruned by a conjunct checked ahead of its turn never reach
+        # the conjuncts written before it, so their errors aren't raised
+        self.assertEqual(parse('sum({x + y if 1 / (x - y) > 0 and y > 5 '
+                               'for x in {1, 2}, y in {1, 0}})'), (int, 0))
+        self.assertEqual(parse('sum({x + y + z if 1 / (x - z) > 0 and y == x '
+                               'for x in {-1, 2, 3}, y in {0, 1, 2}, z in {-1, 0, 1, 3}})'),
+                         (int, 12))
+
+    def test_materialization_cache(self):
+        calls = []
+        def f(x):
+            calls.append(x)
+            return x * 2
+
+        cache = MaterializationCache(maxsize=12)
+        use_cache(cache)
+        try:
+            expr = compile('v in {f(x) + k for x in {1, 2, 3}}')
+            self.assertEqual([expr(v=v, k=1, f=f) for v in range(8)],
+                             [False, False, False, True, False, True, False, True])
+            self.assertEqual((cache.hits, cache.rebuilds, len(calls)), (7, 1, 3))
+
+            # the set is materialized again when its bindings change
+            self.assertEqual(expr(v=8, k=2, f=f), True)
+            self.assertEqual((cache.hits, cache.rebuilds, len(cache)), (7, 2, 1))
+
+            # least recently used sets are evicted
+            list(compile('{x for x in {1, 2, 3, 4, 5, 6, 7, 8}}')())
+            self.assertEqual(sorted(compile('{x for x in {1, 2, 3}}')()), [1, 2, 3])
+            self.assertEqual((len(cache), cache.size, cache.evictions), (2, 11, 1))
+
+            # equal bindings of different types aren't conflated
+            typed = compile('v in {str(x * k) for x in D}')
+            d = Enumeration([2])
+            self.assertEqual(typed(v='2', k=1, D=d), True)
+            self.assertEqual(typed(v='2.0', k=1.0, D=d), True)
+            self.assertEqual(typed(v='2', k=True, D=d), True)
+            self.assertEqual(typed(v='2.0', k=1.0, D=Enumeration([2.0])), True)
+        finally:
+            use_cache(None)
+
+        self.assertEqual(expr(v=8, k=2, f=f), True)
+
+if __name__ == '__main__':
+    unittest.main()
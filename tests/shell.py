@@ -0,0 +1,103 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io, os, pickle, tempfile, unittest
+
+from contextlib import redirect_stdout
+
+from yaffel.datatypes import *
+from yaffel.exceptions import *
+from yaffel.shell import Session, Shell
+
+class TestShell(unittest.TestCase):
+
+    def run_lines(self, shell, *lines):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            for line in lines:
+                shell.onecmd(line)
+        return out.getvalue()
+
+    def test_session(self):
+        session = Session()
+        self.assertEqual(session.define('double = [x: x * 2]'), ('double', AnonymousFunction))
+        self.assertEqual(session.define('n = double(21)'), ('n', int))
+        self.assertEqual(session.compile('n + 1')(), 43)
+
+        # later definitions are visible to the earlier ones
+        session.define('double = [x: x * 3]')
+        self.assertEqual(session.compile('n')(), 63)
+
+        session.drop('n')
+        self.assertRaises(EvaluationError, session.compile('n'))
+        self.assertRaises(EvaluationError, session.drop, 'n')
+        self.assertRaises(SyntaxError, session.define, 'n + 1')
+
+    def test_snapshot(self):
+        session = Session()
+        session.define('s = {x * k for x in {1, 2} | {3}}')
+        session.define('f = [x: log(x) if x in s else 0]')
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'session')
+            session.save(path)
+
+            loaded = Session()
+            loaded.load(path)
+
+            # files that aren't snapshots are rejected
+            for content in ([1, 2], {'definitions': {}}, b''):
+                with open(path, 'wb') as f:
+                    f.write(content if isinstance(content, bytes) else pickle.dumps(content))
+                self.assertRaises(pickle.UnpicklingError, Session().load, path)
+            shell = Shell()
+            self.assertIn('Invalid session file', self.run_lines(shell, ':load ' + path))
+
+        self.assertEqual(loaded.sources, session.sources)
+        self.assertEqual(loaded.types, session.types)
+        self.assertEqual(loaded.compile('f(2) for k = 1')(), session.compile('f(2) for k = 1')())
+
+    def test_commands(self):
+        shell = Shell()
+        out = self.run_lines(shell, ':let f = [x: x + 1]', ':let y = f(1)', 'y * 2', ':defs',
+                             ':drop y', 'y', ':time f(1)', '')
+        self.assertIn('[int]\033[0m 4', out)
+        self.assertIn('y = f(1)', out)
+        self.assertIn("Error while evaluating 'y'", out)
+        self.assertIn('evaluated in', out)
+        self.assertEqual(list(shell.session.definitions), ['f'])
+
+        # names of commands can be bound like any other
+        out = self.run_lines(shell, ':let time = 5', 'time + 1', ':let load = [x: x * 3]',
+                             'load(2) + time', 'let')
+        self.assertIn('[int]\033[0m 6', out)
+        self.assertIn('[int]\033[0m 11', out)
+        self.assertIn("Error while evaluating 'let'", out)
+
+    def test_loop(self):
+        # errors are reported without leaving the loop
+        shell = Shell()
+        shell.stdin = io.StringIO('y\n1 + 1\n:let y = 2\ny * 2\n')
+        shell.use_rawinput = False
+        out = io.StringIO()
+        with redirect_stdout(out):
+            self.assertRaises(SystemExit, shell.cmdloop)
+        self.assertIn("Error while evaluating 'y'", out.getvalue())
+        self.assertIn('[int]\033[0m 2', out.getvalue())
+        self.assertIn('[int]\033[0m 4', out.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
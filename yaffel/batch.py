@@ -0,0 +1,227 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Evaluation of a single expression over large tabular inputs.
+
+Inputs are either CSV files, whose header gives the names of the columns, or
+sets of binary column files, each holding the raw values of one column as a
+packed array (see the `array` module for the supported type codes). Input
+files are memory-mapped and processed by chunks of rows, so the memory used
+doesn't depend on their size. Results are written by chunks as well, either
+as CSV or as a packed binary array.
+"""
+
+from collections import namedtuple
+from contextlib import ExitStack
+from itertools import islice
+
+from yaffel.exceptions import EvaluationError
+from yaffel.parser import CompiledExpression, compile
+
+import argparse, array, csv, mmap, os, sys, time
+
+__all__ = ['Statistics', 'read_csv', 'evaluate_csv', 'evaluate_columns', 'main']
+
+CHUNK_SIZE = 65536
+
+# yaffel types of the values of binary columns, by type code
+TYPES = {c: float if c in 'fd' else int for c in 'bBhHiIlLqQfd'}
+
+class Statistics(namedtuple('Statistics', ['rows', 'seconds'])):
+    """Number of rows processed by a batch evaluation, and the time it took."""
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else float('inf')
+
+    def __str__(self):
+        return '%i rows in %.3f s (%.0f rows/s)' % (self.rows, self.seconds, self.rows_per_second)
+
+def convert(value):
+    """Converts a CSV field to an int, a float or a string."""
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+def read_csv(path, chunk_size=CHUNK_SIZE, encoding='utf-8'):
+    """Reads the CSV file at ``path`` by chunks.
+
+    Yields the header of the file first, then lists of at most ``chunk_size``
+    rows. Nothing is yielded if the file is empty.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            reader = csv.reader(line.decode(encoding) for line in iter(mm.readline, b''))
+            header = next(reader, None)
+            if header is None:
+                return
+            yield header
+            while True:
+                chunk = list(islice(reader, chunk_size))
+                if not chunk:
+                    break
+                yield chunk
+
+def evaluate_csv(expr, source, destination, chunk_size=CHUNK_SIZE, name='result'):
+    """Evaluates ``expr`` for every row of the CSV file ``source``.
+
+    The free variables of ``expr`` are bound to the columns of the same name,
+    and the results are written as CSV to the text file ``destination``, under
+    a column called ``name``. Empty rows are skipped, and a `csv.Error` is
+    raised for the other rows that don't have as many fields as the header.
+    """
+    if not isinstance(expr, CompiledExpression):
+        expr = compile(expr)
+
+    start = time.perf_counter()
+    rows = 0
+    writer = csv.writer(destination, lineterminator='\n')
+    writer.writerow([name])
+
+    chunks = read_csv(source, chunk_size)
+    header = next(chunks, None)
+    if header is not None:
+        # only convert the columns that are actually used by the expression
+        free = expr.free_variables
+        columns = [(i,c) for i,c in enumerate(header) if c in free]
+
+        for chunk in chunks:
+            # blank lines, such as trailing ones, are read as empty rows
+            chunk = [row for row in chunk if row]
+            for k,row in enumerate(chunk, rows + 1):
+                if len(row) != len(header):
+                    raise csv.Error('row %i: expected %i fields, got %i' %
+                                    (k, len(header), len(row)))
+            writer.writerows([expr(**{c: convert(row[i]) for i,c in columns})] for row in chunk)
+            rows += len(chunk)
+
+    return Statistics(rows, time.perf_counter() - start)
+
+def evaluate_columns(expr, columns, destination, chunk_size=CHUNK_SIZE, typecode=None):
+    """Evaluates ``expr`` for every row of a set of binary column files.
+
+    ``columns`` maps the names of the columns to tuples (path, typecode). The
+    results are written to ``destination``, either as a packed array of type
+    ``typecode`` if one is given, or as text with one value per line.
+    """
+    if not isinstance(expr, CompiledExpression):
+        expr = compile(expr, types={n: TYPES[t] for n,(_,t) in columns.items()})
+
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        views = {}
+        for name,(path,code) in columns.items():
+            f = stack.enter_context(open(path, 'rb'))
+            if os.fstat(f.fileno()).st_size == 0:
+                views[name] = memoryview(b'').cast(code)
+                continue
+            mm = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            views[name] = memoryview(mm).cast(code)
+            # views must be released before their underlying map is closed
+            stack.callback(views[name].release)
+
+        lengths = {len(v) for v in views.values()}
+        if len(lengths) > 1:
+            raise ValueError('columns have different lengths')
+        rows = lengths.pop() if lengths else 0
+
+        names = [n for n in views if n in expr.free_variables]
+        for i in range(0, rows, chunk_size):
+            data = []
+            for n in names:
+                with views[n][i:i+chunk_size] as part:
+                    data.append(part.tolist())
+
+            if names:
+                results = [expr(**dict(zip(names, values))) for values in zip(*data)]
+            else:
+                results = [expr() for _ in range(min(chunk_size, rows - i))]
+
+            if typecode is not None:
+                array.array(typecode, results).tofile(destination)
+            else:
+                destination.write(''.join('%s\n' % r for r in results))
+
+    return Statistics(rows, time.perf_counter() - start)
+
+def column(arg):
+    try:
+        name, spec = arg.split('=', 1)
+        path, typecode = spec.rsplit(':', 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid column '%s', expected NAME=PATH:TYPECODE" % arg)
+    if typecode not in TYPES:
+        raise argparse.ArgumentTypeError("invalid type code '%s'" % typecode)
+    return name, (path, typecode)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='yaffel batch',
+        description='Evaluate an expression for every row of a CSV file or of binary columns.')
+    parser.add_argument('expression')
+    parser.add_argument('input', nargs='?', help='CSV input file')
+    parser.add_argument('-c', '--column', action='append', type=column, default=[],
+                        metavar='NAME=PATH:TYPECODE', help='binary column file')
+    parser.add_argument('-o', '--output', help='output file (defaults to stdout)')
+    parser.add_argument('-t', '--output-type', choices=sorted(TYPES), metavar='TYPECODE',
+                        help='write results as a packed binary array of the given type')
+    parser.add_argument('-n', '--name', default='result', help='name of the CSV result column')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    if (args.input is None) == (not args.column):
+        parser.error('either a CSV input file or binary columns must be given')
+    if args.input is not None and args.output_type is not None:
+        parser.error('binary output is only supported for binary columns')
+
+    binary = args.output_type is not None
+    with ExitStack() as stack:
+        if args.output:
+            out = stack.enter_context(open(args.output, 'wb') if binary else
+                                      open(args.output, 'w', newline=''))
+        else:
+            out = sys.stdout.buffer if binary else sys.stdout
+
+        try:
+            if args.input is not None:
+                stats = evaluate_csv(args.expression, args.input, out, args.chunk_size, args.name)
+            else:
+                stats = evaluate_columns(args.expression, dict(args.column), out,
+                                         args.chunk_size, args.output_type)
+        except SyntaxError as e:
+            print('\033[91mSyntax error: %s\033[0m' % e, file=sys.stderr)
+            return -1
+        except EvaluationError as e:
+            print("\033[91mError while evaluating '%s': %s\033[0m" % (args.expression, e),
+                  file=sys.stderr)
+            return -1
+        except (TypeError, ValueError) as e:
+            print('\033[91mType inconsistency: %s\033[0m' % e, file=sys.stderr)
+            return -1
+        except csv.Error as e:
+            print('\033[91mInvalid CSV input: %s\033[0m' % e, file=sys.stderr)
+            return -1
+
+    print(stats, file=sys.stderr)
+    return 0
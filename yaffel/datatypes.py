@@ -15,38 +15,262 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from bisect import bisect_right
+from collections import ChainMap
 from funcparserlib.lexer import Token
-from itertools import zip_longest
+from heapq import merge
+from itertools import chain
+from types import MappingProxyType
 from yaffel.exceptions import UnboundValueError, InvalidExpressionError
 
 import numbers, importlib
 
 __all__ = ['Name', 'Expression', 'ConditionalExpression', 'AnonymousFunction', 'Application',
-           'Set', 'Enumeration', 'Range']
+           'Set', 'Enumeration', 'Range', 'IntervalSet', 'LazyOperator']
 
-def value_of(variable, context):
-    #if hasattr(variable, '__call__'):
-    if any(isinstance(variable, t) for t in (Expression, Application, Set)):
-        # `variable` is either an instance of Expression or Application, we simply evaluate it
-        return variable(**context)
-    elif isinstance(variable, Name):
+def trampoline(steps):
+    """Runs a computation written as a generator without growing the python stack.
+
+    Nested computations are requested by yielding their generator, and their
+    result is sent back once they're done. This allows deeply nested expressions
+    to be evaluated or transformed with an explicit stack rather than through
+    recursive calls, whose depth is limited by python.
+    """
+    stack = [steps]
+    value = None
+    while True:
         try:
-            # we try to bound `variable` from the `context`
-            binding = context[variable]
-            return binding if isinstance(binding, AnonymousFunction) else binding(**context)
-        except TypeError:
-            return context[variable]
-        except KeyError:
-            raise UnboundValueError("unbound variable '%s'" % variable) from None
+            request = stack[-1].send(value)
+        except StopIteration as e:
+            stack.pop()
+            if not stack:
+                return e.value
+            value = e.value
+        else:
+            stack.append(request)
+            value = None
+
+def lookup(name, context):
+    try:
+        # we try to bound `name` from the `context`
+        return context[name]
+    except KeyError:
+        raise UnboundValueError("unbound variable '%s'" % name) from None
+
+def value_of(variable, context):
+    if isinstance(variable, Name):
+        # only evaluate yaffel expressions, python objects (including python
+        # functions) are bound as they are
+        variable = lookup(variable, context)
+    if isinstance(variable, NODES):
+        # `variable` is either an instance of Expression, Application or Set,
+        # we simply evaluate it
+        return trampoline(variable._evaluate(context))
 
     # `variable` is not symbolic
     return variable
 
+def evaluation(variable, context):
+    """Generator version of `value_of`, to be used with `yield from` in the
+    evaluation steps of expressions.
+    """
+    if isinstance(variable, Name):
+        variable = lookup(variable, context)
+    if isinstance(variable, NODES):
+        return (yield variable._evaluate(context))
+    return variable
+
+def extend(context, bindings):
+    """Returns a new context where ``bindings`` shadow those of ``context``.
+
+    Only the first mapping of layered contexts is copied, so that the outer
+    ones (e.g. the definitions of a prelude) are shared rather than copied.
+    """
+    if isinstance(context, ChainMap):
+        local = dict(context.maps[0])
+        local.update(bindings)
+        return ChainMap(local, *context.maps[1:])
+    local = dict(context)
+    local.update(bindings)
+    return local
+
+def read_only(context):
+    """Returns a read-only view of ``context``, without copying it."""
+    if isinstance(context, ChainMap):
+        return ChainMap(*(read_only(m) for m in context.maps))
+    return context if isinstance(context, MappingProxyType) else MappingProxyType(context)
+
+def is_value(term):
+    """Tests whether ``term`` is a value, i.e. whether it evaluates to itself."""
+    if isinstance(term, Set):
+        return term._evaluated
+    return not isinstance(term, (Name,) + NODES)
+
+# marks names missing from a context
+MISSING = object()
+
+def rename(node, context):
+    """Returns ``node`` where the free names bound in ``context`` are replaced
+    by their value. ``node`` itself is left unchanged.
+    """
+    return trampoline(renaming(node, context))
+
+def renaming(node, context):
+    if isinstance(node, Name):
+        return context.get(node, node)
+    elif hasattr(node, '_rename'):
+        return (yield node._rename(context))
+    return node
+
+def to_string(term):
+    """Returns the string representation of ``term``."""
+    parts = []
+    trampoline(string(term, parts))
+    return ''.join(parts)
+
+def string(term, parts):
+    """Generator appending the string representation of ``term`` to ``parts``.
+
+    Nested terms append their own parts to the same list, which is joined once
+    at the end, so writing a term is linear in its size however deep it is.
+    """
+    if isinstance(term, Token):
+        parts.append(term.value)
+    elif hasattr(term, '_str'):
+        yield term._str(parts)
+    else:
+        parts.append(str(term))
+
+def free_variables(node, bound=frozenset()):
+    """Returns the set of names that appear free in ``node``.
+
+    Names in function position are included, as they may be bound by the
+    context as well as refer to built-in functions.
+    """
+    ret = set()
+    trampoline(_free_variables(node, frozenset(bound), ret))
+    return ret
+
+def _free_variables(node, bound, ret):
+    if isinstance(node, Name):
+        if node not in bound:
+            ret.add(node)
+        return
+
+    if isinstance(node, ConditionalExpression):
+        children = [node._condition, node._else_expr, Expression(node._unfolded_expr)]
+    elif isinstance(node, Expression):
+        children = [node._unfolded_expr[0]] + [b for _,b in node._unfolded_expr[1:]]
+    elif isinstance(node, Application):
+        children = [node._function] + list(node._args)
+    elif isinstance(node, AnonymousFunction):
+        children = [node._expr]
+        bound = bound | set(node._args)
+    elif isinstance(node, Range):
+        children = [node.lower_bound, node.upper_bound]
+    elif isinstance(node, Enumeration):
+        children = node._sequence
+    elif isinstance(node, IntervalSet):
+        return
+    elif isinstance(node, Set):
+        children = list(node.context.values())
+        yield _free_variables(node.function, bound | set(node.context), ret)
+    else:
+        return
+
+    for child in children:
+        if isinstance(child, Name):
+            if child not in bound:
+                ret.add(child)
+        elif child is not None:
+            yield _free_variables(child, bound, ret)
+
+def _structure(term):
+    """Returns the atoms and the subterms of ``term`` if it is an expression,
+    a function or an application, or None otherwise.
+    """
+    if isinstance(term, Expression):
+        terms = term._unfolded_expr or ()
+        return ((Expression, len(terms)) + tuple(f for f,_ in terms[1:]),
+                list(terms[:1]) + [b for _,b in terms[1:]])
+    elif isinstance(term, AnonymousFunction):
+        return (AnonymousFunction, term._args), [term._expr]
+    elif isinstance(term, Application):
+        return (Application, len(term._args)), [term._function] + list(term._args)
+    return None
+
+def structural_hash(term):
+    """Returns the hash of ``term``, computed from its atoms in prefix order.
+
+    Subterms are walked with an explicit stack, rather than hashed recursively,
+    so that deeply nested terms can be hashed.
+    """
+    atoms = []
+    stack = [term]
+    while stack:
+        t = stack.pop()
+        structure = _structure(t)
+        if structure is None:
+            atoms.append(t)
+        else:
+            atoms.extend(structure[0])
+            stack.extend(reversed(structure[1]))
+    return hash(tuple(atoms))
+
+def structurally_equal(a, b):
+    """Tests whether ``a`` and ``b`` have the same structure and atoms, with an
+    explicit stack rather than recursively.
+    """
+    stack = [(a, b)]
+    while stack:
+        a, b = stack.pop()
+        if a is b:
+            continue
+        structure_a, structure_b = _structure(a), _structure(b)
+        if structure_a is None or structure_b is None:
+            if structure_a is not structure_b or not a == b:
+                return False
+        elif structure_a[0] != structure_b[0]:
+            return False
+        else:
+            stack.extend(zip(structure_a[1], structure_b[1]))
+    return True
+
+def builtin_function(name):
+    """Returns the python built-in function called ``name``, or None."""
+    for mod in ('builtins', 'math',):
+        fx = getattr(importlib.import_module(mod), name, None)
+        if fx: return fx
+    return None
+
 class Name(str):
     """Represents a symbolic name in expressions or contexts."""
     def __new__(cls, c_str):
         return str.__new__(cls, c_str)
 
+class LazyOperator(object):
+    """Represents a binary operator whose right operand is evaluated lazily.
+
+    Unlike regular operators, which are applied on the values of both their
+    operands, a lazy operator receives the value of its left operand, its
+    right operand unevaluated and the evaluation context. This allows
+    operators such as `and` or `or` to skip the evaluation of their right
+    operand when the left one is sufficient to determine the result.
+
+    The function of a lazy operator is a generator, that evaluates the right
+    operand with `yield from evaluation(b, context)` if it needs its value.
+    """
+
+    def __init__(self, function, symbol):
+        self.function = function
+        self.symbol = symbol
+
+    def __call__(self, a, b, context):
+        return self.function(a, b, context)
+
+    def __str__(self):
+        return self.symbol
+
 class Expression(object):
     """Represents an expression as an anonymous function.
 
@@ -61,7 +285,8 @@ class Expression(object):
         # [t1, (f1, t2), (f2, t3), ...] starting with a term followed
         # unfolded_expr arbitrary number of tuples (operator, term),
         # such that E = f1(t1, f2(t2, ...)).
-        self._unfolded_expr = unfolded_expr
+        # Expressions are immutable, so that they can be shared between threads.
+        self._unfolded_expr = tuple(unfolded_expr) if unfolded_expr is not None else None
 
     def __call__(self, **context):
         """Evaluates the expression value.
@@ -69,63 +294,77 @@ class Expression(object):
         This method evaluates the expression, using ``context`` to bind its
         free variables, if such are present.
         """
-        try:
-            # retrieve the first term value
-            a = value_of(self._unfolded_expr[0], context)
-        except TypeError:
-            # `_unfolded_expr` is either [] or not iterable
+        return trampoline(self._evaluate(context))
+
+    def _evaluate(self, context):
+        if not self._unfolded_expr:
             raise InvalidExpressionError("'%s' is not a valid expression" %
-                                         self._unfolded_expr) from None
+                                         (self._unfolded_expr,))
+
+        # retrieve the first term value
+        a = self._unfolded_expr[0]
+        if isinstance(a, Name):
+            a = lookup(a, context)
+        if isinstance(a, NODES):
+            a = yield a._evaluate(context)
 
         # evaluate expression
         for f,b in self._unfolded_expr[1:]:
-            a = f(a, value_of(b, context))
+            if isinstance(f, LazyOperator):
+                # let lazy operators decide whether `b` should be evaluated
+                a = yield from f(a, b, context)
+                continue
+
+            if isinstance(b, Name):
+                b = lookup(b, context)
+            if isinstance(b, NODES):
+                b = yield b._evaluate(context)
+            a = f(a, b)
         return a
 
     def rename_variable(self, context):
-        a = self._unfolded_expr[0]
-        if isinstance(a, Name):
-            # `a` is a name and we want to rename it if it exists in the `context`
-            self._unfolded_expr[0] = context.get(a,a)
-        elif isinstance(a, Expression):
-            # `a` is an expression so we delegate the renaming to it
-            a.rename_variable(context)
-
-        for i in range(1, len(self._unfolded_expr)):
-            f,b = self._unfolded_expr[i]
-            if isinstance(b, Name):
-                # `b` is a name and we want to rename it if it exists in the `context`
-                self._unfolded_expr[i] = (f, context.get(b,b))
-            elif isinstance(b, Expression):
-                # `b` is an expression so we delegate the renaming to it
-                b.rename_variable(context)
+        """Returns a copy of the expression where the names bound in ``context``
+        are replaced by their value.
+        """
+        return trampoline(self._rename(context))
+
+    def _rename(self, context):
+        return Expression((yield from self._renamed_terms(context)))
+
+    def _renamed_terms(self, context):
+        terms = [(yield from renaming(self._unfolded_expr[0], context))]
+        for f,b in self._unfolded_expr[1:]:
+            terms.append((f, (yield from renaming(b, context))))
+        return terms
 
     def _unfolded_expr_str(self):
-        if not self._unfolded_expr: return ''
-    
-        # helper function to get the string representation of a term
-        sym = lambda term: term.value if isinstance(term, Token) else str(term)
+        parts = []
+        trampoline(self._terms_str(parts))
+        return ''.join(parts)
 
-        # if the expression is simple a constant
-        a = sym(self._unfolded_expr[0])
-        if len(self._unfolded_expr) <= 1:
-            return a
+    def _terms_str(self, parts):
+        if not self._unfolded_expr: return
 
-        ret = ''
-        for f,b in self._unfolded_expr[1:]:
-            a = '%(f)s(%(a)s, %(b)s)' % {'f': f, 'a': a, 'b': sym(b)}
-        return a        
+        # E = f1(t1, f2(t2, ...)) is written as the list of the function names,
+        # in reverse order, followed by the terms
+        parts.extend('%s(' % f for f,_ in reversed(self._unfolded_expr[1:]))
+        yield from string(self._unfolded_expr[0], parts)
+        for _,b in self._unfolded_expr[1:]:
+            parts.append(', ')
+            yield from string(b, parts)
+            parts.append(')')
+
+    def _str(self, parts):
+        yield from self._terms_str(parts)
 
     def __hash__(self):
-        if self._unfolded_expr is None:
-            return 0
-        return hash(tuple(self._unfolded_expr))
+        return structural_hash(self)
 
     def __eq__(self, other):
-        return all(a == b for a,b in zip_longest(self.unfolded_expr, other.unfolded_expr))
+        return structurally_equal(self, other)
 
     def __str__(self):
-        return self._unfolded_expr_str()
+        return to_string(self)
 
     def __repr__(self):
         return '%s(%s)' % (self.__class__, str(self))
@@ -147,19 +386,28 @@ class ConditionalExpression(Expression):
         else:
             super().__init__([expr])
 
-    def __call__(self, **context):
-        if bool(self._condition(**context)):
-            return super().__call__(**context)
+    def _evaluate(self, context):
+        # only the branch selected by the condition is evaluated
+        if (yield from evaluation(self._condition, context)):
+            return (yield from super()._evaluate(context))
         elif self._else_expr is not None:
-            return self._else_expr(**context)
+            return (yield from evaluation(self._else_expr, context))
         raise UnboundValueError("conditional expression '%s' has no else expression" % str(self))
 
-    def __str__(self):
-        return '%(expr)s if %(cond)s else %(else)s' % {
-            'expr': self._unfolded_expr_str(),
-            'cond': self._condition._unfolded_expr_str(),
-            'else': self._else_expr._unfolded_expr_str() if self._else_expr else 'None',
-        }
+    def _rename(self, context):
+        return ConditionalExpression(Expression((yield from self._renamed_terms(context))),
+                                     (yield from renaming(self._condition, context)),
+                                     (yield from renaming(self._else_expr, context)))
+
+    def _str(self, parts):
+        yield from self._terms_str(parts)
+        parts.append(' if ')
+        yield from string(self._condition, parts)
+        parts.append(' else ')
+        if self._else_expr is not None:
+            yield from string(self._else_expr, parts)
+        else:
+            parts.append('None')
 
 class AnonymousFunction(object):
     """Represents an anonymous function.
@@ -169,32 +417,41 @@ class AnonymousFunction(object):
     """
 
     def __init__(self, args, expr):
-        self._args = args
+        self._args = tuple(args)
         self._expr = expr
 
     def __call__(self, *argv, **context):
+        return value_of(self._expr, self._scope(argv, context))
+
+    def _scope(self, argv, context):
         if len(argv) != len(self._args):
             raise TypeError("%s takes %i arguments but %i were given" %
                             (self, len(self._args), len(argv)))
-        context.update({self._args[i]: argv[i] for i in range(len(self._args))})
-        return self._expr(**context)
+
+        # bind the arguments in a new scope, so the caller's context is left unchanged
+        return extend(context, zip(self._args, argv))
 
     def rename_variable(self, context):
+        return trampoline(self._rename(context))
+
+    def _rename(self, context):
         # don't rename variables that needs to be bound in function arguments
-        super().__init__({n:v for n,v in context.items() if n not in self._args})
+        return AnonymousFunction(self._args, (yield from renaming(self._expr, {
+            n:v for n,v in context.items() if n not in self._args})))
 
     def __hash__(self):
-        return hash(tuple(self._args + [super().__hash__()]))
+        return structural_hash(self)
 
     def __eq__(self, other):
-        f = lambda x,y: all(a == b for a,b in zip_longest(x,y))
-        return f(self._args, other._args) and f(self._unfolded_expr, other._unfolded_expr)
+        return structurally_equal(self, other)
 
     def __str__(self):
-        return '[%(args)s: %(expr)s]' % {
-            'args': ', '.join(self._args),
-            'expr': str(self._expr)
-        }
+        return to_string(self)
+
+    def _str(self, parts):
+        parts.append('[%s: ' % ', '.join(self._args))
+        yield from string(self._expr, parts)
+        parts.append(']')
 
     def __repr__(self):
         return '%s(%s)' % (self.__class__, str(self))
@@ -214,22 +471,26 @@ class Application(object):
 
     def __init__(self, function, args):
         self._function = function
-        self._args = args
+        self._args = tuple(args)
 
     def __call__(self, **context):
-        if isinstance(self._function, AnonymousFunction):
-            # `_function` is an AnonymousFunction so we simply call it
-            return self._function(*(value_of(a, context) for a in self._args))
+        return trampoline(self._evaluate(context))
 
-        try:
+    def _evaluate(self, context):
+        if isinstance(self._function, AnonymousFunction):
+            # `_function` is an AnonymousFunction so we simply call it, in the
+            # same scope as functions bound to a name
+            args = yield from self._evaluate_args(context)
+            return (yield from evaluation(self._function._expr, self._function._scope(args, context)))
+
+        if not isinstance(self._function, Name):
+            fx = self._function
+        elif self._function in context:
             # `_function` is a symbol, we first try to bound it from the context
-            fx = value_of(self._function, context)
-        except UnboundValueError:
+            fx = yield from evaluation(self._function, context)
+        else:
             # if `function` can't be bound from the context, try to use a built-in
-            fx = None
-            for mod in ('builtins', 'math',):
-                fx = getattr(importlib.import_module(mod), self._function, None)
-                if fx: break
+            fx = builtin_function(self._function)
 
         # raise an evaluation error if `_function` couldn't be bound
         if not fx:
@@ -239,21 +500,44 @@ class Application(object):
                             type(fx).__name__)
 
         # apply fx
-        # TODO instanciate yaffel sets as python iterable so we can call python
-        # built-in functions than run on tierables, such as `sum`
+        args = yield from self._evaluate_args(context)
         if isinstance(fx, AnonymousFunction):
-            return fx(*(value_of(a, context) for a in self._args), **context)
-        return fx(*(value_of(a, context) for a in self._args))
+            return (yield from evaluation(fx._expr, fx._scope(args, context)))
+        return fx(*args)
+
+    def _evaluate_args(self, context):
+        args = []
+        for a in self._args:
+            args.append((yield from evaluation(a, context)))
+        return args
+
+    def rename_variable(self, context):
+        return trampoline(self._rename(context))
+
+    def _rename(self, context):
+        function = yield from renaming(self._function, context)
+        args = []
+        for a in self._args:
+            args.append((yield from renaming(a, context)))
+        return Application(function, args)
 
     def __hash__(self):
-        return hash(tuple([hash(self.function)] + self.args))
+        return structural_hash(self)
 
     def __eq__(self, other):
-        f = lambda x,y: all(a == b for a,b in zip_longest(x,y))
-        return (self._function == other._function) and f(self._args, other._args)
+        return structurally_equal(self, other)
 
     def __str__(self):
-        return '%s(%s)' % (self._function, ', '.join(map(str, self._args)))
+        return to_string(self)
+
+    def _str(self, parts):
+        yield from string(self._function, parts)
+        parts.append('(')
+        for i,a in enumerate(self._args):
+            if i:
+                parts.append(', ')
+            yield from string(a, parts)
+        parts.append(')')
 
     def __repr__(self):
         return '%s(%s)' % (self.__class__, str(self))
@@ -264,35 +548,179 @@ class Set(object):
     Sets are represented symbolically as a tuple (f,u) where f is a function
     and u another set. Let a set S be defined by (f,u), then elements of S are
     given by {f(x) | x \in u}.
+
+    Once evaluated, a set keeps the context it was evaluated in as its
+    ``scope``, so that its elements can be enumerated later on. Evaluated sets
+    evaluate to themselves, and a set remembers its last evaluated form, which
+    is returned again as long as its domains and the bindings its function
+    depends on are the same objects.
     """
 
-    def __init__(self, function, context):
+    def __init__(self, function, context, scope=None):
         self.function = function
-        self.context = context
+        self.context = MappingProxyType(dict(context))
+        self.scope = read_only(scope) if scope is not None else None
+        self._evaluated = scope is not None
+        self._last = None
 
     def __call__(self, **context):
-        return Set(self.function, {k: v(**context) for k,v in self.context.items()})
+        return trampoline(self._evaluate(context))
+
+    def _evaluate(self, context):
+        if self._evaluated:
+            return self
+
+        domains = {}
+        for k,v in self.context.items():
+            domains[k] = yield from evaluation(v, context)
+
+        # reuse the last evaluated form if nothing it captured has changed
+        last = self._last
+        if last is not None:
+            evaluated, captured = last
+            if all(domains[k] is evaluated.context[k] for k in domains) and \
+               all(context.get(n, MISSING) is evaluated.scope.get(n, MISSING) for n in captured):
+                return evaluated
+
+        evaluated = Set(self.function, domains, context)
+        self._last = (evaluated, self.captured(context))
+        return evaluated
+
+    def captured(self, context):
+        """Returns the names the function of the set depends on, directly or
+        through their definitions in ``context``. Names that ``context``
+        doesn't bind are included, as they may be bound later on.
+        """
+        ret = set()
+        names = list(free_variables(self.function, set(self.context)))
+        while names:
+            n = names.pop()
+            if n not in ret:
+                ret.add(n)
+                if n in context:
+                    names.extend(free_variables(context[n]))
+        return tuple(ret)
+
+    def __getstate__(self):
+        # mapping proxies can't be pickled, and the last evaluated form of the
+        # set is a cache that may hold any python object
+        return {k: dict(v) if isinstance(v, (MappingProxyType, ChainMap)) else v
+                for k,v in self.__dict__.items() if k != '_last'}
+
+    def __setstate__(self, state):
+        for k in ('context', 'scope'):
+            if state.get(k) is not None:
+                state[k] = MappingProxyType(state[k])
+        self.__dict__.update(state)
+        self._last = None
+
+    def __iter__(self):
+        from yaffel.planner import materialize
+        return iter(materialize(self))
+
+    def __contains__(self, item):
+        from yaffel.planner import materialize
+        return item in materialize(self)
+
+    def contains(self, item, context):
+        """Tests whether ``item`` belongs to the set.
+
+        Unlike the `in` operator of python, this method is called on the
+        unevaluated set, so that subclasses may only evaluate what is necessary
+        to determine the membership of ``item``.
+        """
+        return trampoline(self._contains(item, context))
+
+    def _contains(self, item, context):
+        return item in (yield self._evaluate(context))
+
+    def rename_variable(self, context):
+        return trampoline(self._rename(context))
+
+    def _rename(self, context):
+        # don't rename variables that are bound by the set context
+        scope = {n:v for n,v in context.items() if n not in self.context}
+        function = yield from renaming(self.function, scope)
+        domains = {}
+        for n,d in self.context.items():
+            domains[n] = yield from renaming(d, context)
+        return Set(function, domains)
 
     def __eq__(self, other):
         if not isinstance(other, Set):
             return False
-        return (self.function, other.function) and (self.context == other.context)
+        return (self.function == other.function) and (self.context == other.context)
 
     def __repr__(self):
         return '%s(%s)' % (self.__class__, str(self))
 
     def __str__(self):
-        f = lambda c: '%s in %s' % (c[0], str(c[1]))
-        return '{%s for %s}' % (self.function, ', '.join(f(c) for c in self.context.items()))
+        return to_string(self)
+
+    def __or__(self, other):
+        return interval_set(self).union(interval_set(other)).simplified()
+
+    def __and__(self, other):
+        return interval_set(self).intersection(interval_set(other)).simplified()
+
+    def __sub__(self, other):
+        return interval_set(self).difference(interval_set(other)).simplified()
+
+    def __invert__(self):
+        return interval_set(self).complement().simplified()
+
+    def _str(self, parts):
+        parts.append('{')
+        yield from string(self.function, parts)
+        parts.append(' for ')
+        for i,(n,d) in enumerate(self.context.items()):
+            parts.append('%s%s in ' % (', ' if i else '', n))
+            yield from string(d, parts)
+        parts.append('}')
 
 class Enumeration(Set):
     """Kind of set that simply enumerates values."""
 
     def __init__(self, elements):
-        self.elements = frozenset(elements)
-
-    def __call__(self, **context):
-        return Enumeration(e(**context) for e in self.elements)
+        # keep the order in which elements were given, so that lazy membership
+        # tests evaluate them from left to right
+        self._sequence = tuple(elements)
+        self.elements = frozenset(self._sequence)
+        self._evaluated = all(is_value(e) for e in self._sequence)
+        self._last = None
+
+    def _evaluate(self, context):
+        if self._evaluated:
+            return self
+
+        # reuse the last evaluated form if the elements evaluate to the same
+        # objects
+        last = self._last
+        elements = None
+        for i,e in enumerate(self._sequence):
+            value = yield from evaluation(e, context)
+            if elements is None and (last is None or value is not last._sequence[i]):
+                elements = list(last._sequence[:i]) if last is not None else []
+            if elements is not None:
+                elements.append(value)
+        if elements is None and last is not None:
+            return last
+
+        self._last = Enumeration(elements or [])
+        return self._last
+
+    def _contains(self, item, context):
+        # evaluate elements one by one, and stop as soon as one matches
+        for e in self._sequence:
+            if (yield from evaluation(e, context)) == item:
+                return True
+        return False
+
+    def _rename(self, context):
+        elements = []
+        for e in self._sequence:
+            elements.append((yield from renaming(e, context)))
+        return Enumeration(elements)
 
     def __hash__(self):
         return hash(self.elements)
@@ -305,11 +733,19 @@ class Enumeration(Set):
     def __contains__(self, item):
         return item in self.elements
 
+    def __iter__(self):
+        return iter(self.elements)
+
     def __repr__(self):
         return '%s(%s)' % (self.__class__, str(self))
 
-    def __str__(self):
-        return '{%s}' % ', '.join(str(e) for e in self.elements)
+    def _str(self, parts):
+        parts.append('{')
+        for i,e in enumerate(self.elements):
+            if i:
+                parts.append(', ')
+            yield from string(e, parts)
+        parts.append('}')
 
 class Range(Set):
     """Numeric set that contains values from its lower to its upper bound."""
@@ -317,11 +753,22 @@ class Range(Set):
     def __init__(self, lower_bound, upper_bound):
         self.lower_bound = lower_bound
         self.upper_bound = upper_bound
+        self._evaluated = (isinstance(lower_bound, numbers.Real) and
+                           isinstance(upper_bound, numbers.Real) and lower_bound < upper_bound)
+        self._last = None
+
+    def _evaluate(self, context):
+        if self._evaluated:
+            return self
 
-    def __call__(self, **context):
         # evaluate lower and upper bounds
-        lower = self.lower_bound(**context)
-        upper = self.upper_bound(**context)
+        lower = yield from evaluation(self.lower_bound, context)
+        upper = yield from evaluation(self.upper_bound, context)
+
+        # reuse the last evaluated form if the bounds are the same objects
+        last = self._last
+        if last is not None and lower is last.lower_bound and upper is last.upper_bound:
+            return last
 
         # check type consistency
         if not isinstance(lower, numbers.Real) or not isinstance(upper, numbers.Real):
@@ -329,7 +776,12 @@ class Range(Set):
         if not lower < upper:
             raise TypeError('range defined with unordered bounds')
 
-        return Range(lower, upper)
+        self._last = Range(lower, upper)
+        return self._last
+
+    def _rename(self, context):
+        return Range((yield from renaming(self.lower_bound, context)),
+                     (yield from renaming(self.upper_bound, context)))
 
     def __eq__(self, other):
         if not isinstance(other, Range):
@@ -341,8 +793,197 @@ class Range(Set):
             return False
         return (item >= self.lower_bound) and (item <= self.upper_bound)
 
+    def __iter__(self):
+        raise TypeError("can't enumerate the elements of the range %s" % self)
+
     def __repr__(self):
         return '%s(%s)' % (self.__class__, str(self))
 
-    def __str__(self):
-        return '{%s:%s}' % (repr(self.lower_bound), self.upper_bound)
+    def _str(self, parts):
+        parts.append('{')
+        yield from string(self.lower_bound, parts)
+        parts.append(':')
+        yield from string(self.upper_bound, parts)
+        parts.append('}')
+
+def interval_set(s):
+    """Returns the evaluated set ``s`` as an IntervalSet."""
+    if isinstance(s, IntervalSet):
+        return s
+    elif isinstance(s, Range):
+        return IntervalSet([(s.lower_bound, s.upper_bound, True, True)])
+    elif isinstance(s, Enumeration):
+        points = sorted(e for e in s.elements if isinstance(e, numbers.Real))
+        return IntervalSet([(e, e, True, True) for e in points],
+                           [e for e in s.elements if not isinstance(e, numbers.Real)])
+    elif isinstance(s, Set):
+        return interval_set(Enumeration(s))
+    raise TypeError("invalid type '%s' for a set operation" % type(s).__name__)
+
+def coalesce(intervals):
+    """Merges the overlapping or adjacent intervals of ``intervals``, which
+    must be sorted by lower bound, closed bounds first.
+    """
+    ret = []
+    for lower, upper, lower_closed, upper_closed in intervals:
+        if ret:
+            l, u, lc, uc = ret[-1]
+            if lower < u or (lower == u and (uc or lower_closed)):
+                if upper > u:
+                    ret[-1] = (l, upper, lc, upper_closed)
+                elif upper == u:
+                    ret[-1] = (l, u, lc, uc or upper_closed)
+                continue
+        ret.append((lower, upper, lower_closed, upper_closed))
+    return ret
+
+def lower_bound_key(interval):
+    return (interval[0], not interval[2])
+
+class IntervalSet(Set):
+    """Normalized representation of the result of set operations.
+
+    The numbers of the set are represented by sorted, disjoint and non-adjacent
+    intervals (lower, upper, lower_closed, upper_closed), single numbers being
+    closed intervals whose bounds are equal. Other values are kept in a hash
+    set, ``members``; if ``cofinite`` is true, the set contains every value
+    that isn't a number except its members.
+
+    Operations on interval sets take a time proportional to their number of
+    intervals and members, and membership is tested by bisection.
+    """
+
+    def __init__(self, intervals=(), members=(), cofinite=False):
+        self.intervals = tuple(intervals)
+        self.members = frozenset(members)
+        self.cofinite = cofinite
+        self._lower_bounds = [i[0] for i in self.intervals]
+        self._evaluated = True
+        self._last = None
+
+    def _evaluate(self, context):
+        # interval sets only hold values
+        yield from ()
+        return self
+
+    def _rename(self, context):
+        yield from ()
+        return self
+
+    def union(self, other):
+        intervals = coalesce(merge(self.intervals, other.intervals, key=lower_bound_key))
+        if self.cofinite and other.cofinite:
+            return IntervalSet(intervals, self.members & other.members, True)
+        elif self.cofinite:
+            return IntervalSet(intervals, self.members - other.members, True)
+        elif other.cofinite:
+            return IntervalSet(intervals, other.members - self.members, True)
+        return IntervalSet(intervals, self.members | other.members)
+
+    def complement(self):
+        intervals = []
+        lower, lower_closed = -float('inf'), False
+        for l, u, lc, uc in self.intervals:
+            if lower < l or (lower == l and lower_closed and not lc):
+                intervals.append((lower, l, lower_closed, not lc))
+            lower, lower_closed = u, not uc
+        if lower < float('inf'):
+            intervals.append((lower, float('inf'), lower_closed, False))
+        return IntervalSet(intervals, self.members, not self.cofinite)
+
+    def intersection(self, other):
+        return self.complement().union(other.complement()).complement()
+
+    def difference(self, other):
+        return self.intersection(other.complement())
+
+    def simplified(self):
+        """Returns an Enumeration or a Range equal to this set if there's one."""
+        if self.cofinite:
+            return self
+        elif all(l == u for l, u, _, _ in self.intervals):
+            return Enumeration([l for l, _, _, _ in self.intervals] + list(self.members))
+        elif not self.members and len(self.intervals) == 1 and all(self.intervals[0][2:]):
+            return Range(*self.intervals[0][:2])
+        return self
+
+    def __hash__(self):
+        return hash((self.intervals, self.members, self.cofinite))
+
+    def __eq__(self, other):
+        if not isinstance(other, IntervalSet):
+            return False
+        return ((self.intervals, self.members, self.cofinite) ==
+                (other.intervals, other.members, other.cofinite))
+
+    def __contains__(self, item):
+        if isinstance(item, numbers.Real):
+            i = bisect_right(self._lower_bounds, item) - 1
+            if i < 0:
+                return False
+            lower, upper, lower_closed, upper_closed = self.intervals[i]
+            return ((item > lower or (lower_closed and item == lower)) and
+                    (item < upper or (upper_closed and item == upper)))
+
+        try:
+            return (item in self.members) is not self.cofinite
+        except TypeError:
+            # unhashable values can't be members
+            return self.cofinite
+
+    def __iter__(self):
+        if self.cofinite or any(l != u for l, u, _, _ in self.intervals):
+            raise TypeError("can't enumerate the elements of the infinite set %s" % self)
+        return chain((l for l, _, _, _ in self.intervals), self.members)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__, str(self))
+
+    def _str(self, parts):
+        if self.cofinite:
+            parts.append('~(')
+            yield self.complement()._str(parts)
+            parts.append(')')
+            return
+
+        # intervals are written as ranges, from which their open bounds are
+        # removed, so that the set can be parsed again
+        intervals = []
+        points = []
+        for l, u, lc, uc in self.intervals:
+            if l == u:
+                points.append(number_str(l))
+                continue
+            interval = '{%s:%s}' % (number_str(l), number_str(u))
+            excluded = [number_str(b) for b, closed in ((l, lc), (u, uc)) if not closed]
+            if excluded:
+                interval = '(%s - {%s})' % (interval, ', '.join(excluded))
+            intervals.append(interval)
+        parts.append(' | '.join(intervals))
+
+        # isolated points and other members are grouped in a single enumeration
+        if points or self.members or not intervals:
+            parts.append(' | {' if intervals else '{')
+            parts.append(', '.join(points))
+            separator = ', ' if points else ''
+            for m in self.members:
+                parts.append(separator)
+                if isinstance(m, str):
+                    parts.append('"%s"' % m)
+                else:
+                    yield from string(m, parts)
+                separator = ', '
+            parts.append('}')
+
+def number_str(x):
+    """Returns ``x`` as a yaffel literal, infinities being written as numbers
+    too large to be represented.
+    """
+    if x == float('inf'):
+        return '1e+309'
+    elif x == -float('inf'):
+        return '-1e+309'
+    return str(x)
+
+# nodes that are evaluated when bound to a name or used as a term
+NODES = (Expression, Application, Set)
@@ -0,0 +1,583 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from functools import reduce
+from yaffel.datatypes import *
+from yaffel.datatypes import evaluation, rename, renaming, trampoline, builtin_function, free_variables
+
+import numbers, operator
+
+__all__ = ['infer', 'optimize', 'specialize', 'MembershipTest', 'Guard', 'BuiltinApplication']
+
+# Types are represented by python classes: bool, int, float and str for
+# primitive values, Set for any kind of set and AnonymousFunction for
+# functions. `numbers.Real` stands for a number whose exact type can't be
+# determined statically, and None for a completely unknown type.
+
+NUMBERS = (bool, int, float, numbers.Real)
+
+SYMBOLS = {
+    operator.add: '+', operator.sub: '-', operator.mul: '*', operator.truediv: '/',
+    operator.pow: '**', operator.lt: '<', operator.le: '<=', operator.eq: '==',
+    operator.ne: '!=', operator.ge: '>=', operator.gt: '>', operator.or_: '|',
+    operator.and_: '&',
+}
+
+# Annotated built-in functions, as a tuple (argument type, result type). The
+# result type is either a type or a function computing it from the argument
+# types. Built-ins that aren't annotated have an unknown result type.
+BUILTINS = {
+    'abs': (numbers.Real, lambda *t: promote(*t)),
+    'min': (None, lambda *t: reduce(join, t) if len(t) > 1 else None),
+    'max': (None, lambda *t: reduce(join, t) if len(t) > 1 else None),
+    'round': (numbers.Real, lambda *t: int if len(t) == 1 else promote(*t)),
+    'bool': (None, bool),
+    'int': (None, int),
+    'float': (None, float),
+    'str': (None, str),
+    'len': (None, int),
+    'ceil': (numbers.Real, int),
+    'floor': (numbers.Real, int),
+    'trunc': (numbers.Real, int),
+    'factorial': (numbers.Real, int),
+}
+BUILTINS.update({f: (numbers.Real, float) for f in (
+    'sqrt', 'exp', 'log', 'log2', 'log10', 'sin', 'cos', 'tan', 'asin', 'acos', 'atan',
+    'atan2', 'sinh', 'cosh', 'tanh', 'degrees', 'radians', 'hypot', 'fabs')})
+
+def type_name(t):
+    if t is numbers.Real:
+        return 'number'
+    return t.__name__
+
+def is_number(t):
+    return t in NUMBERS
+
+def promote(*types):
+    """Returns the type of the result of an arithmetic operation."""
+    if not all(is_number(t) for t in types):
+        return None
+    elif float in types:
+        return float
+    elif numbers.Real in types:
+        return numbers.Real
+    return int
+
+def join(a, b):
+    """Returns the type of a value that is either of type ``a`` or ``b``."""
+    if a == b:
+        return a
+    elif is_number(a) and is_number(b):
+        return numbers.Real
+    return None
+
+def operation_type(f, a, b):
+    """Returns the type of ``f(x,y)`` for x of type ``a`` and y of type ``b``.
+
+    A TypeError is raised if both types are known and incompatible with ``f``.
+    """
+    if isinstance(f, LazyOperator):
+        if f.symbol in ('in', 'not in') and b is not None and b not in (Set, str):
+            raise TypeError("argument of type '%s' is not a set" % type_name(b))
+        return bool
+    elif f in (operator.eq, operator.ne):
+        return bool
+    elif f in (operator.or_, operator.and_):
+        # unions and intersections are only defined on sets
+        for t in (a, b):
+            if t not in (Set, None):
+                raise TypeError("unsupported operand type for %s: '%s'" % (SYMBOLS[f], type_name(t)))
+        return Set
+
+    if a is None or b is None:
+        # comparisons always produce booleans, other operations are unknown
+        return bool if f in (operator.lt, operator.le, operator.ge, operator.gt) else None
+
+    if f in (operator.add, operator.sub, operator.mul, operator.truediv, operator.pow):
+        if is_number(a) and is_number(b):
+            if f is operator.truediv:
+                return float
+            elif f is operator.pow:
+                # the power of two integers is a float for negative exponents
+                return float if float in (a, b) else numbers.Real
+            return promote(a, b)
+        elif f is operator.sub and a is Set and b is Set:
+            return Set
+        elif f is operator.add and a is str and b is str:
+            return str
+        elif f is operator.mul and str in (a, b) and (a in (bool, int) or b in (bool, int)):
+            return str
+    elif f in (operator.lt, operator.le, operator.ge, operator.gt):
+        if (is_number(a) and is_number(b)) or (a is str and b is str):
+            return bool
+    else:
+        return None
+
+    raise TypeError("unsupported operand types for %s: '%s' and '%s'" %
+                    (SYMBOLS.get(f, f), type_name(a), type_name(b)))
+
+class Inference(object):
+    """Infers the types of the nodes of a parsed expression.
+
+    Names are resolved first from ``types``, which maps names to their types
+    (e.g. the arguments of an anonymous function), then from ``context``, which
+    maps names to the expressions they are bound to. Names that can be resolved
+    from neither are considered of unknown type, as they may still be bound when
+    the expression is evaluated.
+    """
+
+    def __init__(self, context=None, types=None):
+        self.context = context or {}
+        self.types = types or {}
+        self._resolved = {}
+        self._stack = []
+
+    def infer(self, node, types=None):
+        return trampoline(self._infer(node, types))
+
+    def _infer(self, node, types=None):
+        # nested nodes are inferred by yielding their steps to `trampoline`, so
+        # that deeply nested expressions don't exhaust the python stack
+        types = self.types if types is None else types
+
+        if isinstance(node, Name):
+            if node in types:
+                return types[node]
+            elif node in self.context:
+                return (yield from self.resolve(node))
+            return None
+        elif isinstance(node, bool):
+            return bool
+        elif isinstance(node, (int, float, str)):
+            return type(node)
+        elif isinstance(node, ConditionalExpression):
+            yield self._infer(node._condition, types)
+            t = yield from self.infer_terms(node._unfolded_expr, types)
+            if node._else_expr is None:
+                return t
+            return join(t, (yield self._infer(node._else_expr, types)))
+        elif isinstance(node, Expression):
+            return (yield from self.infer_terms(node._unfolded_expr, types))
+        elif isinstance(node, Application):
+            return (yield from self.infer_application(node, types))
+        elif isinstance(node, AnonymousFunction):
+            yield from self.infer_function(node, [None] * len(node._args), types)
+            return AnonymousFunction
+        elif isinstance(node, Range):
+            for bound in (node.lower_bound, node.upper_bound):
+                t = yield self._infer(bound, types)
+                if t is not None and not is_number(t):
+                    raise TypeError("range defined for non-numeric bound '%s'" % bound)
+            return Set
+        elif isinstance(node, Enumeration):
+            for e in node._sequence:
+                yield self._infer(e, types)
+            return Set
+        elif isinstance(node, IntervalSet):
+            return Set
+        elif isinstance(node, Set):
+            for n,domain in node.context.items():
+                t = yield self._infer(domain, types)
+                if t is not None and t is not Set:
+                    raise TypeError("'%s' is bound to a non-set value" % n)
+            # names bound by the set context shadow those of the outer scopes
+            scope = dict(types)
+            scope.update({n: None for n in node.context})
+            yield self._infer(node.function, scope)
+            return Set
+
+        return None
+
+    def infer_terms(self, terms, types):
+        t = yield self._infer(terms[0], types)
+        for f,b in terms[1:]:
+            t = operation_type(f, t, (yield self._infer(b, types)))
+        return t
+
+    def infer_function(self, function, argument_types, types):
+        if len(argument_types) != len(function._args):
+            raise TypeError("%s takes %i arguments but %i were given" %
+                            (function, len(function._args), len(argument_types)))
+
+        # stop at recursive applications, whose type can't be determined
+        if any(f is function for f in self._stack):
+            return None
+
+        scope = dict(types)
+        scope.update(zip(function._args, argument_types))
+        self._stack.append(function)
+        try:
+            return (yield self._infer(function._expr, scope))
+        finally:
+            self._stack.pop()
+
+    def infer_application(self, node, types):
+        argument_types = []
+        for a in node._args:
+            argument_types.append((yield self._infer(a, types)))
+
+        function = node._function
+        if isinstance(function, Name):
+            if function in types:
+                return None
+            elif function in self.context:
+                function = self.context[function]
+                if isinstance(function, Name) or not isinstance(function, AnonymousFunction):
+                    return None
+            elif function in BUILTINS:
+                expected, result = BUILTINS[function]
+                for t in argument_types:
+                    if expected is not None and t is not None and not issubclass(t, expected):
+                        raise TypeError("%s() argument must be a %s, not '%s'" %
+                                        (function, type_name(expected), type_name(t)))
+                if not isinstance(result, type):
+                    return result(*argument_types)
+                return result
+            else:
+                return None
+
+        if isinstance(function, AnonymousFunction):
+            return (yield from self.infer_function(function, argument_types, types))
+        elif function is operator.not_:
+            return bool
+        elif function is operator.invert:
+            # complements are only defined on sets
+            t = argument_types[0]
+            if t not in (Set, None):
+                raise TypeError("bad operand type for unary ~: '%s'" % type_name(t))
+            return Set
+        return None
+
+    def resolve(self, name):
+        if name not in self._resolved:
+            # mark the name as being resolved, so that recursive definitions
+            # are considered of unknown type
+            self._resolved[name] = None
+            self._resolved[name] = yield self._infer(self.context[name], self.types)
+        return self._resolved[name]
+
+def infer(node, context=None, types=None):
+    """Infers the type of ``node``.
+
+    A TypeError is raised if the expression is found to be ill-typed, that is if
+    it would necessarily raise a TypeError when evaluated.
+    """
+    return Inference(context, types).infer(node)
+
+class MembershipTest(LazyOperator):
+    """Operator testing the membership of a value in a precomputed set.
+
+    The right operand of the operator is the set it was computed from, which
+    is kept for display purposes only and never evaluated.
+    """
+
+    def __init__(self, container, negated=False):
+        super().__init__(None, 'not in' if negated else 'in')
+        self.container = container
+        self.negated = negated
+
+    def __call__(self, a, b, context):
+        yield from ()
+        return (a in self.container) is not self.negated
+
+class Guard(Expression):
+    """Expression that checks the type of its value when it is evaluated.
+
+    Guards are emitted by the optimizer where a specialized operation expects
+    a type that couldn't be determined statically.
+    """
+
+    def __init__(self, term, expected, message):
+        super().__init__([term])
+        self._expected = expected
+        self._message = message
+
+    def _evaluate(self, context):
+        value = yield from evaluation(self._unfolded_expr[0], context)
+        if not isinstance(value, self._expected):
+            raise TypeError(self._message % type(value).__name__)
+        return value
+
+    def _rename(self, context):
+        return Guard((yield from renaming(self._unfolded_expr[0], context)),
+                     self._expected, self._message)
+
+class BuiltinApplication(Application):
+    """Application of a built-in function resolved statically.
+
+    The built-in function is only called directly if its name isn't bound by
+    the evaluation context, which would otherwise shadow the built-in.
+    """
+
+    def __init__(self, function, args, builtin):
+        super().__init__(function, args)
+        self._builtin = builtin
+
+    def _evaluate(self, context):
+        if self._function in context:
+            return (yield from super()._evaluate(context))
+        return self._builtin(*(yield from self._evaluate_args(context)))
+
+    def _rename(self, context):
+        if self._function in context:
+            return (yield from super()._rename(context))
+        args = []
+        for a in self._args:
+            args.append((yield from renaming(a, context)))
+        return BuiltinApplication(self._function, args, self._builtin)
+
+def is_constant(node):
+    return isinstance(node, (bool, int, float, str)) and not isinstance(node, Name)
+
+class Optimizer(Inference):
+    """Rewrites a parsed expression into a semantically equivalent one that is
+    faster to evaluate, using the inferred types of its nodes.
+    """
+
+    def optimize(self, node, types=None):
+        return trampoline(self._optimize(node, types))
+
+    def _optimize(self, node, types=None):
+        types = self.types if types is None else types
+
+        if isinstance(node, ConditionalExpression):
+            condition = yield self._optimize(node._condition, types)
+            expr = Expression((yield from self.optimize_terms(node._unfolded_expr, types)))
+            else_expr = None
+            if node._else_expr is not None:
+                else_expr = yield self._optimize(node._else_expr, types)
+
+            # select the branch statically if the condition is constant
+            if is_constant(condition):
+                if condition:
+                    return self.fold(expr)
+                elif else_expr is not None:
+                    return else_expr
+            if not isinstance(condition, Expression):
+                condition = Expression([condition])
+            return ConditionalExpression(expr, condition, else_expr)
+        elif isinstance(node, Expression):
+            return self.fold(Expression((yield from self.optimize_terms(node._unfolded_expr, types))))
+        elif isinstance(node, Application):
+            return (yield from self.optimize_application(node, types))
+        elif isinstance(node, AnonymousFunction):
+            scope = dict(types)
+            scope.update({a: None for a in node._args})
+            return AnonymousFunction(node._args, (yield self._optimize(node._expr, scope)))
+        elif isinstance(node, Range):
+            return Range((yield self._optimize(node.lower_bound, types)),
+                         (yield self._optimize(node.upper_bound, types)))
+        elif isinstance(node, Enumeration):
+            elements = []
+            for e in node._sequence:
+                elements.append((yield self._optimize(e, types)))
+            return Enumeration(elements)
+        elif isinstance(node, IntervalSet):
+            return node
+        elif isinstance(node, Set):
+            scope = dict(types)
+            scope.update({n: None for n in node.context})
+            function = yield self._optimize(node.function, scope)
+            domains = {}
+            for n,d in node.context.items():
+                domains[n] = yield self._optimize(d, types)
+            return Set(function, domains)
+
+        return node
+
+    def optimize_terms(self, terms, types):
+        ret = [(yield self._optimize(terms[0], types))]
+        for f,b in terms[1:]:
+            b = yield self._optimize(b, types)
+
+            # precompute the value of constant sets on the right of `in`
+            if isinstance(f, LazyOperator) and f.symbol in ('in', 'not in'):
+                container = self.evaluate_set(b)
+                if container is not None:
+                    ret.append((MembershipTest(container, f.symbol == 'not in'), b))
+                    continue
+
+            ret.append((f, b))
+
+        # fold the longest constant prefix of the expression
+        folded, i = ret[0], 1
+        while i < len(ret) and is_constant(folded) and (
+                isinstance(ret[i][0], MembershipTest) or is_constant(ret[i][1])):
+            try:
+                value = Expression([folded, ret[i]])()
+            except Exception:
+                break
+            if not is_constant(value):
+                break
+            folded, i = value, i + 1
+        return [folded] + ret[i:]
+
+    def fold(self, expr):
+        if len(expr._unfolded_expr) == 1 and is_constant(expr._unfolded_expr[0]):
+            return expr._unfolded_expr[0]
+        return expr
+
+    def evaluate_set(self, node):
+        if isinstance(node, Enumeration) and all(is_constant(e) for e in node._sequence):
+            return node.elements
+        elif isinstance(node, Range) and is_constant(node.lower_bound) and is_constant(node.upper_bound):
+            try:
+                return node()
+            except TypeError:
+                return None
+        elif isinstance(node, (Expression, Application)) and not free_variables(node):
+            # operations on constant sets
+            try:
+                value = node()
+            except Exception:
+                return None
+            if isinstance(value, Enumeration):
+                return value.elements
+            elif isinstance(value, (Range, IntervalSet)):
+                return value
+        return None
+
+    def optimize_application(self, node, types):
+        args = []
+        for a in node._args:
+            args.append((yield self._optimize(a, types)))
+
+        function = node._function
+        if isinstance(function, AnonymousFunction):
+            return Application((yield self._optimize(function, types)), args)
+        elif (not isinstance(function, Name) or function in types or function in self.context
+              or function not in BUILTINS):
+            return Application(function, args)
+
+        builtin = builtin_function(function)
+        if builtin is None:
+            return Application(function, args)
+
+        # guard the arguments whose type couldn't be checked statically
+        expected = BUILTINS[function][0]
+        if expected is not None:
+            message = "%s() argument must be a %s, not '%%s'" % (function, type_name(expected))
+            args = tuple(a if self.infer(a, types) is not None else Guard(a, expected, message)
+                         for a in args)
+        return BuiltinApplication(function, args, builtin)
+
+def optimize(node, context=None, types=None):
+    """Returns an optimized version of ``node``.
+
+    The optimizer folds constant subexpressions, selects the branch of
+    conditional expressions whose condition is constant, precomputes the sets
+    of membership tests, and resolves annotated built-in functions statically,
+    guarding their arguments whose type is unknown.
+    """
+    return Optimizer(context, types).optimize(node)
+
+def binders(node):
+    """Returns the set of names bound by the functions and sets in ``node``."""
+    ret = set()
+    stack = [node]
+    while stack:
+        n = stack.pop()
+        if isinstance(n, ConditionalExpression):
+            stack.extend([n._condition, n._else_expr, Expression(n._unfolded_expr)])
+        elif isinstance(n, Expression):
+            stack.extend([n._unfolded_expr[0]] + [b for _,b in n._unfolded_expr[1:]])
+        elif isinstance(n, Application):
+            stack.extend([n._function] + list(n._args))
+        elif isinstance(n, AnonymousFunction):
+            ret.update(n._args)
+            stack.append(n._expr)
+        elif isinstance(n, Range):
+            stack.extend([n.lower_bound, n.upper_bound])
+        elif isinstance(n, Enumeration):
+            stack.extend(n._sequence)
+        elif isinstance(n, Set) and not isinstance(n, IntervalSet):
+            ret.update(n.context)
+            stack.extend([n.function] + list(n.context.values()))
+    return ret
+
+class Specializer(Optimizer):
+    """Optimizer that also inlines the applications of non-recursive functions
+    and calls annotated built-in functions whose arguments are constant.
+
+    Functions are only inlined if their arguments are constants or names that
+    aren't bound within their body, so that inlining never captures a name.
+    """
+
+    def __init__(self, context=None, types=None):
+        super().__init__(context, types)
+        self._recursive = {}
+        self._inlining = []
+
+    def optimize_application(self, node, types):
+        function = node._function
+        if (isinstance(function, Name) and function not in types and
+                function in self.context and not self.is_recursive(function)):
+            function = self.context[function]
+
+        if isinstance(function, AnonymousFunction):
+            args = []
+            for a in node._args:
+                a = yield self._optimize(a, types)
+                if type(a) is Expression and len(a._unfolded_expr) == 1:
+                    a = a._unfolded_expr[0]
+                args.append(a)
+            if self.can_inline(function, args):
+                body = rename(function._expr, dict(zip(function._args, args)))
+                self._inlining.append(function)
+                try:
+                    return (yield self._optimize(body, types))
+                finally:
+                    self._inlining.pop()
+
+        application = yield from super().optimize_application(node, types)
+        if isinstance(application, BuiltinApplication) and all(is_constant(a) for a in application._args):
+            try:
+                value = application()
+            except Exception:
+                return application
+            if is_constant(value):
+                return value
+        return application
+
+    def can_inline(self, function, args):
+        if len(function._args) != len(args) or any(f is function for f in self._inlining):
+            return False
+        elif not all(is_constant(a) or isinstance(a, Name) for a in args):
+            return False
+        return not ({a for a in args if isinstance(a, Name)} & binders(function._expr))
+
+    def is_recursive(self, name):
+        """Tests whether the definition of ``name`` refers to itself, possibly
+        through other definitions of the context.
+        """
+        if name not in self._recursive:
+            visited = set()
+            stack = list(free_variables(self.context[name]))
+            while stack:
+                n = stack.pop()
+                if n in visited or n not in self.context:
+                    continue
+                visited.add(n)
+                stack.extend(free_variables(self.context[n]))
+            self._recursive[name] = name in visited
+        return self._recursive[name]
+
+def specialize(node, context=None, types=None):
+    """Returns an optimized version of ``node``, in which the applications of
+    non-recursive functions are inlined.
+    """
+    return Specializer(context, types).optimize(node)
@@ -15,12 +15,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from collections import namedtuple
+from collections import ChainMap, namedtuple
 from funcparserlib.lexer import make_tokenizer, Token
 from funcparserlib.parser import some, a, many, maybe, finished, skip, forward_decl, NoParseError
 from functools import reduce
+from types import MappingProxyType
 
 from yaffel.datatypes import *
+from yaffel.datatypes import value_of, evaluation, free_variables, rename
+from yaffel.exceptions import EvaluationError
+from yaffel.inference import infer, is_constant, optimize, specialize
 
 import operator, sys
 
@@ -34,7 +38,7 @@ def tokenize(s):
         ('space',    (r'[ \t\r\n]+',)),
         ('number',   (r'-?(0|([1-9][0-9]*))(\.[0-9]+)?([Ee][+-][0-9]+)?',)),
         ('string',   (r'"[^"]*"',)),                                # unsupported escaped quotes
-        ('operator', (r'(\*\*)|([><=!]=)|(and)|(or)|(not)|(in)|[{}\[\]\(\)\-\+\*/=><\.,:]',)),
+        ('operator', (r'(\*\*)|([><=!]=)|(and)|(or)|(not)|(in)|[{}\[\]\(\)\-\+\*/=><\.,:|&~]',)),
         ('name',     (r'[A-Za-z_][A-Za-z_0-9]*',)),
     ]
 
@@ -63,22 +67,21 @@ def make_string(t):
 def make_bool(t):
     return t == 'True'
 
-def logical_and(op):
-    return lambda x,y: bool(x) and bool(y)
-def logical_or(op):
-    return lambda x,y: bool(x) or bool(y)
-
-def eval_expr(x):
-    if hasattr(x[0], '__call__'):
-        # Whenever an expression is parsed, an instance of Expression is
-        # created. Then, when we want to evaluate the result of the
-        # expression for a given binding, this function will be called,
-        # using the context bindings as the function parameters.
-        context = x[1] or {}
-        return x[0](**context)
-
-    # If the expression is constant, we don't need to evaluate it.
-    return x[0]
+def logical_and(x, y, context):
+    return bool(x) and bool((yield from evaluation(y, context)))
+def logical_or(x, y, context):
+    return bool(x) or bool((yield from evaluation(y, context)))
+
+def contains(item, container, context):
+    # look through names bound to sets, so we can test membership on the
+    # unevaluated set rather than on its value
+    if isinstance(container, Name) and isinstance(context.get(container), Set):
+        container = context[container]
+    if isinstance(container, Set):
+        return (yield from container._contains(item, context))
+    return item in (yield from evaluation(container, context))
+def not_contains(item, container, context):
+    return not (yield from contains(item, container, context))
 
 def concatenate(head, tail):
     for _,s in tail:
@@ -102,9 +105,14 @@ def make_expression(head, tail):
 
 def make_renaming(expr, context):
     if context:
-        expr.rename_variable(context)
+        return rename(expr, context)
     return expr
 
+def make_unary(operator, operand):
+    if operator is None:
+        return operand
+    return Application(operator, (operand,))
+
 def make_predicate(head, tail):
     if tail is None:
         return head
@@ -134,8 +142,7 @@ def make_context(head, tail):
 def make_enum(x):
     # check that the enumeration is not the empty set
     if x is not None:
-        e = {x[0]} | {e for e in x[1]}
-        return Enumeration(e)
+        return Enumeration([x[0]] + x[1])
 
     # return the empty set
     return Enumeration([])
@@ -177,8 +184,12 @@ mul         = op('*') >> const(operator.mul)
 div         = op('/') >> const(operator.truediv)
 power       = op('**') >> const(operator.pow)
 
-and_        = op('and') >> logical_and
-or_         = op('or') >> logical_or
+union       = op('|') >> const(operator.or_)
+intersection= op('&') >> const(operator.and_)
+complement  = op('~') >> const(operator.invert)
+
+and_        = op('and') >> const(LazyOperator(logical_and, 'and'))
+or_         = op('or') >> const(LazyOperator(logical_or, 'or'))
 not_        = op('not') >> const(operator.not_)
 
 lt          = op('<') >> const(operator.lt)
@@ -188,8 +199,8 @@ ne          = op('!=') >> const(operator.ne)
 ge          = op('>=') >> const(operator.ge)
 gt          = op('>') >> const(operator.gt)
 
-in_         = op('in') >> const(lambda x,y: x in y)
-not_in      = op('not') + op('in') >> const(lambda x,y: x not in y)
+in_         = op('in') >> const(LazyOperator(contains, 'in'))
+not_in      = op('not') + op('in') >> const(LazyOperator(not_contains, 'not in'))
 
 true        = kw('True') >> token_value >> make_bool
 false       = kw('False') >> token_value >> make_bool
@@ -198,6 +209,12 @@ name        = token_type('name') >> token_value >> make_name
 number      = token_type('number') >> token_value >> make_number
 string      = token_type('string') >> token_value >> make_string
 
+# bracketed groups, parsed separately (see `fold_brackets`)
+group       = token_type('group') >> token_value
+set_group   = token_type('set') >> token_value
+lambda_group= token_type('lambda') >> token_value
+tuple_group = token_type('tuple') >> token_value
+
 # grammar rules
 mul_op      = mul | div
 add_op      = add | sub
@@ -209,7 +226,6 @@ bexpr       = forward_decl()
 sexpr       = forward_decl()
 expr        = forward_decl()
 
-lambda_     = forward_decl()
 application = forward_decl()
 renaming    = forward_decl()
 set_context = forward_decl()
@@ -218,7 +234,7 @@ set_context = forward_decl()
 strexpr     = string + many(add_op + string) >> u(concatenate)
 
 # numerical expression
-numeric     = application | lambda_ | number | name | (op_('(') + nexpr + op_(')'))
+numeric     = application | lambda_group | number | name | group
 factor      = numeric + many(power + numeric) >> u(make_expression)
 term        = factor + many(mul_op + factor) >> u(make_expression)
 nexpr.define( term + many(add_op + term) >> u(make_expression) )
@@ -227,7 +243,7 @@ nexpr.define( term + many(add_op + term) >> u(make_expression) )
 proposition = (sexpr | strexpr | nexpr)
 pred        = proposition + maybe(cmp_op + proposition) >> u(make_predicate)
 
-formula     = true | false | pred | (op_('(') + bexpr + op_(')'))
+formula     = true | false | pred
 conjunction = formula + many(and_ + formula) >> u(make_expression)
 disjunction = conjunction + many(or_ + conjunction) >> u(make_expression)
 bexpr.define( maybe(not_) + disjunction >> make_boolean )
@@ -236,22 +252,28 @@ bexpr.define( maybe(not_) + disjunction >> make_boolean )
 enumeration = op_('{') + maybe(expr + many(op_(',') + expr)) + op_('}') >> make_enum
 range_      = op_('{') + nexpr + op_(':') + nexpr  + op_('}') >> u(make_range)
 set_        = op_('{') + expr + maybe(kw_('for') + set_context) + op_('}') >> u(make_set)
-sexpr.define( enumeration | range_ | set_ )
+braces      = enumeration | range_ | set_
+
+# set algebra, where `-` is the difference and `~` the complement
+set_operand = maybe(complement) + (set_group | nexpr) >> u(make_unary)
+difference  = set_operand + many(sub + set_operand) >> u(make_expression)
+inter       = difference + many(intersection + difference) >> u(make_expression)
+sexpr.define( inter + many(union + inter) >> u(make_expression) )
 
 # anonymous function
-lambda_.define( op_('[') + maybe(name + many(op_(',') + name)) + op_(':') + expr + op_(']')
-                >> make_lambda )
+lambda_     = op_('[') + maybe(name + many(op_(',') + name)) + op_(':') + expr + op_(']') \
+                >> make_lambda
 
 # function application
 tuple_      = op_('(') + maybe(expr + many(op_(',') + expr)) + op_(')') >> make_tuple
-application.define( (lambda_ | name) + tuple_ >> u(make_application) )
+application.define( (lambda_group | name) + tuple_group >> u(make_application) )
 
 # conditional expression
 uexpr       = bexpr | sexpr | nexpr | strexpr
 cexpr       = uexpr + kw_('if') + bexpr + maybe(kw_('else') + uexpr) >> u(make_conditional)
 
 # expression context
-binding     = name + op_('=') + (renaming | op_('(') + renaming + op_(')')) >> u(make_binding)
+binding     = name + op_('=') + renaming >> u(make_binding)
 context     = binding + many(op_(',') + binding) >> u(make_context)
 renaming.define( expr + maybe(kw_('for') + context) >> u(make_renaming) )
 
@@ -261,16 +283,238 @@ set_context.define( set_binding + many(op_(',') + set_binding) >> u(make_context
 
 # any expression
 expr.define( cexpr | uexpr )
-yaffel = expr + maybe(kw_('for') + context) + skip(finished) >> eval_expr
+program     = expr + maybe(kw_('for') + context) + skip(finished)
+definition  = binding + skip(finished)
+
+# parsers of the bracketed groups
+parentheses = op_('(') + renaming + op_(')')
+groups      = {
+    'group':  parentheses + skip(finished),
+    'tuple':  tuple_ + skip(finished),
+    'set':    braces + skip(finished),
+    'lambda': lambda_ + skip(finished),
+}
+
+brackets    = {'(': ')', '{': '}', '[': ']'}
+bracket_keywords = ['if', 'else', 'for', 'True', 'False']
+
+def group_type(opening, previous):
+    if opening.value == '{':
+        return 'set'
+    elif opening.value == '[':
+        return 'lambda'
+    elif previous is not None and (previous.type == 'lambda' or
+                                   previous.type == 'name' and previous.value not in bracket_keywords):
+        # parentheses following a function are the arguments of an application
+        return 'tuple'
+    return 'group'
+
+def fold_brackets(tokens):
+    """Replaces the bracketed groups of ``tokens`` by tokens holding their value.
+
+    Groups are parsed separately, from the innermost to the outermost, so that
+    the depth of the recursion of the parser doesn't depend on how deeply the
+    brackets are nested. Each group is replaced by a token whose type is the
+    kind of group (i.e. 'group', 'tuple', 'set' or 'lambda') and whose value is
+    the parsed group.
+    """
+    stack = [[]]
+    for t in tokens:
+        if t.type == 'operator' and t.value in brackets:
+            stack.append([t])
+        elif t.type == 'operator' and t.value in brackets.values():
+            if len(stack) == 1 or brackets[stack[-1][0].value] != t.value:
+                raise SyntaxError("%s: unbalanced '%s'" % (t.pformat(), t.value))
+
+            tokens = stack.pop() + [t]
+            previous = stack[-1][-1] if stack[-1] else None
+            kind = group_type(tokens[0], previous)
+            stack[-1].append(Token(kind, groups[kind].parse(tokens), tokens[0].start, t.end))
+        else:
+            stack[-1].append(t)
+
+    if len(stack) > 1:
+        raise SyntaxError("%s: unbalanced '%s'" % (stack[-1][0].pformat(), stack[-1][0].value))
+    return stack[0]
+
+class CompiledExpression(object):
+    """Represents a parsed, but not yet evaluated, yaffel expression.
+
+    A compiled expression can be evaluated several times without being parsed
+    again. Its free variables are bound by the keyword arguments given when it
+    is called, while the bindings of its own context (i.e. those declared after
+    the `for` keyword) take precedence. Both shadow the definitions of the
+    prelude.
+    """
+
+    def __init__(self, expr, context=None, type=None, prelude=None):
+        self.expr = expr
+        self.context = MappingProxyType(dict(context or {}))
+        self.type = type
+        self.prelude = prelude
+
+        # bindings of the prelude are shadowed by those of the context, and
+        # looked up through it rather than copied
+        if prelude is not None:
+            self._scope = ChainMap(self.context, prelude.definitions)
+        else:
+            self._scope = self.context
+
+    def __call__(self, **bindings):
+        context = dict(bindings)
+        context.update(self.context)
+        if self.prelude is not None:
+            context = ChainMap(context, self.prelude.definitions)
+        return value_of(self.expr, context)
+
+    @property
+    def free_variables(self):
+        """The names that should be bound when the expression is evaluated."""
+        ret = free_variables(self.expr)
+        for binding in self.context.values():
+            ret |= free_variables(binding)
+        return ret - set(self._scope)
+
+    def specialize(self, **bindings):
+        """Returns the residual expression obtained by binding some of the free
+        variables of this expression to ``bindings``.
+
+        Bound values are substituted in the expression and in its context, so
+        that constant subexpressions and decidable conditions are folded, and
+        non-recursive functions are inlined. Definitions of the context that
+        become constant are substituted too, and the residual expression only
+        keeps the definitions it still refers to.
+        """
+        bindings = {k: v for k,v in bindings.items() if k not in self.context}
+        context = {k: rename(v, bindings) for k,v in
+                   dependencies(self.expr, self._scope).items() if k not in bindings}
+        expr = rename(self.expr, bindings)
+
+        # definitions that become constant are substituted as well, until
+        # there are no more to fold
+        while True:
+            context = {k: specialize(v, context) for k,v in context.items()}
+            constants = {k: v for k,v in context.items() if is_constant(v)}
+            if not constants:
+                break
+            context = {k: rename(v, constants) for k,v in context.items() if k not in constants}
+            expr = rename(expr, constants)
+        expr = specialize(expr, context)
+
+        # the definitions of the prelude the residual expression depends on
+        # are copied to its context, since they may have been specialized
+        residual = dependencies(expr, context)
+        return CompiledExpression(expr, residual, infer(expr, residual))
+
+    def __str__(self):
+        if not self.context:
+            return str(self.expr)
+        return '%s for %s' % (self.expr, ', '.join('%s = %s' % c for c in self.context.items()))
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__, str(self))
+
+def dependencies(node, context):
+    """Returns the definitions of ``context`` that ``node`` refers to, directly
+    or through other definitions.
+    """
+    ret = {}
+    names = list(free_variables(node))
+    while names:
+        n = names.pop()
+        if n in context and n not in ret:
+            ret[n] = context[n]
+            names.extend(free_variables(context[n]))
+    return ret
+
+class Prelude(object):
+    """Set of named definitions shared by several expressions.
+
+    Definitions are type checked and optimized once, when the prelude is
+    created, unless ``compiled`` is true. They can refer to each other, and
+    are shadowed by the context of the expressions that use the prelude.
+    """
+
+    def __init__(self, definitions=None, compiled=False):
+        definitions = dict(definitions or {})
+        if not compiled:
+            for binding in definitions.values():
+                infer(binding, definitions)
+            definitions = {k: optimize(v, definitions) for k,v in definitions.items()}
+        self.definitions = MappingProxyType(definitions)
+
+    def __contains__(self, name):
+        return name in self.definitions
+
+    def __len__(self):
+        return len(self.definitions)
+
+def read_prelude(source):
+    """Creates a prelude from ``source``, which holds one definition of the
+    form `name = expression` per line. Empty lines and lines starting with `#`
+    are ignored.
+    """
+    definitions = {}
+    for i, line in enumerate(source.splitlines(), 1):
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        try:
+            k, v = definition.parse(fold_brackets(tokenize(line)))
+        except NoParseError as e:
+            raise SyntaxError('line %i: %s' % (i, e.msg))
+        if k in definitions:
+            raise EvaluationError("line %i: '%s' is already bound" % (i, k))
+        definitions[k] = v
+    return Prelude(definitions)
+
+def load_prelude(path):
+    """Creates a prelude from the definitions of the file at ``path``."""
+    with open(path) as f:
+        return read_prelude(f.read())
+
+# prelude used by the expressions compiled without an explicit one
+shared_prelude = None
+
+def share_prelude(prelude):
+    """Makes ``prelude`` the default prelude of `parse` and `compile`.
+
+    The prelude isn't copied, and is shared as is by all the expressions
+    compiled afterwards. Use None to stop sharing a prelude.
+    """
+    global shared_prelude
+    shared_prelude = prelude
+
+def parse(seq, prelude=None):
+    parsed = compile(seq, prelude=prelude)()
+    return (type(parsed), parsed)
 
-def parse(seq):
+def compile(seq, types=None, prelude=None):
+    """Parses ``seq`` into an expression that can be evaluated several times.
+
+    ``types`` optionally maps the names that will be bound at evaluation time
+    to their types, so that they can be checked and used to optimize the
+    expression. Names can also be bound by the definitions of ``prelude``, or
+    of the shared prelude if none is given.
+    """
     try:
-        # tokenize and parse the given sequence
-        parsed = yaffel.parse(tokenize(seq))
+        # tokenize and parse the given sequence, without evaluating it
+        expr, context = program.parse(fold_brackets(tokenize(seq)))
     except NoParseError as e:
         raise SyntaxError(e.msg)
 
-    return (type(parsed), parsed)
+    # check the types of the expression and its context before it's evaluated
+    prelude = prelude if prelude is not None else shared_prelude
+    context = context or {}
+    scope = ChainMap(dict(context), prelude.definitions) if prelude is not None else dict(context)
+    types = {k: v for k,v in (types or {}).items() if k not in scope}
+    for binding in context.values():
+        infer(binding, scope, types)
+    t = infer(expr, scope, types)
+
+    # rewrite the expression using the inferred types
+    context = {k: optimize(v, scope, types) for k,v in context.items()}
+    scope.update(context)
+    return CompiledExpression(optimize(expr, scope, types), context, t, prelude)
 
 if __name__ == '__main__':
     #print(tokenize(sys.argv[1]))
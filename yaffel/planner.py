@@ -0,0 +1,338 @@
+# This source file is part of yaffel-py
+# Main Developer : Dimitri Racordon (kyouko.taiga@gmail.com)
+#
+# Copyright 2014 Dimitri Racordon
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+from threading import Lock
+from yaffel.datatypes import *
+from yaffel.datatypes import value_of, extend, free_variables
+
+import itertools, operator
+
+__all__ = ['Planner', 'MaterializationCache', 'elements', 'materialize', 'use_cache']
+
+def conjuncts(condition):
+    """Returns the operands of ``condition`` if it is a conjunction, or a list
+    holding ``condition`` itself otherwise.
+    """
+    ret = []
+    stack = [condition]
+    while stack:
+        c = stack.pop()
+        terms = c._unfolded_expr if type(c) is Expression else ()
+        if len(terms) > 1 and all(isinstance(f, LazyOperator) and f.symbol == 'and'
+                                  for f,_ in terms[1:]):
+            # conjunctions are folded from the left, so push their operands in
+            # reverse order to keep them in the order they were written
+            stack.extend(reversed([terms[0]] + [b for _,b in terms[1:]]))
+        else:
+            ret.append(c)
+    return ret
+
+def bind(scope, name, value):
+    return extend(scope, {name: value})
+
+def holds(conditions, context):
+    return all(value_of(c, context) for c in conditions)
+
+class Planner(object):
+    """Enumerates the elements of a set comprehension.
+
+    If the function of the set is a conditional expression without else
+    expression, its condition is used as a filter, and split into conjuncts.
+    Conjuncts that depend on a single bound variable filter its domain before
+    the loops start, and the others are checked as soon as all the variables
+    they depend on are bound. Loops are ordered by increasing domain size,
+    except that a variable compared for equality with the ones already bound
+    is looked up in a hash index of its domain, rather than scanned.
+
+    Conjuncts are thus checked in a different order than the one they were
+    written in. A conjunct raising an error is assumed to hold, and checked
+    again in order once the other ones hold, so that it doesn't raise errors
+    the condition would have short-circuited. However, errors of conjuncts
+    that aren't checked, because a conjunct written after them failed first,
+    are never raised.
+    """
+
+    def __init__(self, function, names):
+        self.names = list(names)
+        if isinstance(function, ConditionalExpression) and function._else_expr is None:
+            self.value = Expression(function._unfolded_expr)
+            self.conditions = [(c, free_variables(c) & set(self.names))
+                               for c in conjuncts(function._condition)]
+        else:
+            self.value = function
+            self.conditions = []
+
+    def naive(self, domains, scope):
+        ret = []
+        conditions = [c for c,_ in self.conditions]
+        for values in itertools.product(*(list(domains[n]) for n in self.names)):
+            context = extend(scope, zip(self.names, values))
+            if holds(conditions, context):
+                ret.append(value_of(self.value, context))
+        return ret
+
+    def planned(self, domains, scope):
+        """Returns the list of the elements of the set, possibly with duplicates.
+
+        ``domains`` maps the bound variables to their (evaluated) domain, and
+        ``scope`` is the context the set was evaluated in.
+        """
+        # no conjunct is evaluated if a domain is empty
+        domains = {n: list(domains[n]) for n in self.names}
+        if not all(domains.values()):
+            return []
+
+        # check the conjuncts that don't depend on the bound variables once
+        ok, deferred = self.check([i for i,(_,v) in enumerate(self.conditions) if not v], scope, ())
+        if not ok:
+            return []
+
+        # filter the domains by the conjuncts depending on a single variable,
+        # pairing each value with the conjuncts deferred for it
+        candidates = {}
+        for n in self.names:
+            local = [i for i,(_,v) in enumerate(self.conditions) if v == {n}]
+            candidates[n] = []
+            for x in domains[n]:
+                ok, d = self.check(local, bind(scope, n, x), ())
+                if ok:
+                    candidates[n].append((x, d))
+
+        steps = self.plan(candidates, scope)
+        ret = []
+        self.run(steps, 0, scope, deferred, ret)
+        return ret
+
+    def check(self, conditions, context, deferred):
+        """Checks the given conjuncts in ``context``, and returns whether none
+        of them failed, along with the conjuncts deferred so far.
+        """
+        for i in conditions:
+            try:
+                if not value_of(self.conditions[i][0], context):
+                    return False, deferred
+            except Exception:
+                # the error may have been short-circuited by a conjunct
+                # written before, so the conjunct is checked again in order
+                deferred += (i,)
+        return True, deferred
+
+    def plan(self, candidates, scope):
+        """Returns the loops to run, from the outermost to the innermost.
+
+        Each loop is a tuple (name, values, key, conditions). If ``key`` is
+        None, ``values`` is the list of the values to scan; otherwise, it is an
+        index that maps the values of ``key`` to the matching values. Values
+        are paired with the conjuncts deferred for them.
+        Conditions are given by their position in the list of conjuncts.
+        """
+        remaining = [i for i,(_,v) in enumerate(self.conditions) if len(v) > 1]
+        unplanned = sorted(self.names, key=lambda n: len(candidates[n]))
+        bound = set()
+        steps = []
+        self.joins = {}
+
+        while unplanned:
+            # prefer the variables that can be joined with the bound ones
+            for n in unplanned:
+                join = self.join(n, remaining, bound)
+                if join is not None:
+                    break
+            else:
+                n = unplanned[0]
+
+            values, key = candidates[n], None
+            if join is not None:
+                i, key, side = join
+                try:
+                    values = {}
+                    for x,d in candidates[n]:
+                        values.setdefault(value_of(side, bind(scope, n, x)), []).append((x, d))
+                except Exception:
+                    # check the condition as the others if its side can't be
+                    # computed ahead of its turn, or isn't hashable
+                    values, key = candidates[n], None
+                else:
+                    remaining.remove(i)
+                    self.joins[n] = (i, candidates[n])
+
+            unplanned.remove(n)
+            bound.add(n)
+            steps.append((n, values, key,
+                          [i for i in remaining if self.conditions[i][1] <= bound]))
+            remaining = [i for i in remaining if not self.conditions[i][1] <= bound]
+        return steps
+
+    def join(self, name, conditions, bound):
+        """Returns a condition of the form ``a == b``, with ``b`` only depending
+        on ``name`` and ``a`` on the variables of ``bound``, as a tuple
+        (position, a, b), or None if there's none.
+        """
+        if not bound:
+            return None
+        for i in conditions:
+            condition = self.conditions[i][0]
+            terms = condition._unfolded_expr if type(condition) is Expression else ()
+            if len(terms) != 2 or terms[1][0] is not operator.eq:
+                continue
+            for a,b in ((terms[0], terms[1][1]), (terms[1][1], terms[0])):
+                a_vars = free_variables(a) & set(self.names)
+                if free_variables(b) & set(self.names) == {name} and a_vars and a_vars <= bound:
+                    return i, a, b
+        return None
+
+    def run(self, steps, i, context, deferred, ret):
+        if i == len(steps):
+            # check the deferred conjuncts in the order they were written
+            if holds([self.conditions[j][0] for j in sorted(deferred)], context):
+                ret.append(value_of(self.value, context))
+            return
+
+        name, values, key, checks = steps[i]
+        if key is not None:
+            j, candidates = self.joins[name]
+            try:
+                values = values.get(value_of(key, context), ())
+            except Exception:
+                # scan the domain, and check the join condition itself
+                values, checks = candidates, sorted(checks + [j])
+
+        for x,pending in values:
+            scope = bind(context, name, x)
+            ok, d = self.check(checks, scope, deferred + pending)
+            if ok:
+                self.run(steps, i + 1, scope, d, ret)
+
+def elements(s):
+    """Returns the list of the elements of the evaluated set comprehension ``s``."""
+    return Planner(s.function, s.context).planned(s.context, s.scope)
+
+def captured(s):
+    """Returns the bindings of the scope of ``s`` its function depends on, as
+    a sorted tuple of (name, value) pairs.
+    """
+    return tuple(sorted((n, s.scope[n]) for n in s.captured(s.scope) if n in s.scope))
+
+class Identity(object):
+    """Wraps a value so that it's compared by identity."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __eq__(self, other):
+        return isinstance(other, Identity) and self.value is other.value
+
+# values that are compared by type and value in the keys of the cache
+PRIMITIVES = (bool, int, float, complex, str, bytes, type(None))
+
+def cache_key(value):
+    """Returns a key for ``value`` that doesn't conflate equal values of
+    different types (e.g. 1, 1.0 and True), which may not give the same
+    elements once the function of a set is applied to them.
+    """
+    if type(value) in PRIMITIVES:
+        return (type(value), value)
+    return Identity(value)
+
+class MaterializationCache(object):
+    """Cache of the elements of evaluated set comprehensions.
+
+    Sets are keyed on their function, their domains and the bindings their
+    function depends on, so a set whose bindings changed is materialized
+    again, and replaces the elements computed for its previous bindings. The
+    function and the domains of a set, as well as bindings that aren't
+    primitive values, are compared by identity. The least recently used sets
+    are evicted once the cache holds more than ``maxsize`` elements in total.
+    """
+
+    def __init__(self, maxsize=1000000):
+        self.maxsize = maxsize
+        self.size = 0
+        self.hits = 0
+        self.rebuilds = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._latest = {}
+        self._lock = Lock()
+
+    def get(self, s):
+        """Returns the elements of the evaluated set ``s``, as a frozenset."""
+        structure = (Identity(s.function),
+                     tuple((n, Identity(d)) for n,d in s.context.items()))
+        key = (structure, tuple((n, cache_key(v)) for n,v in captured(s)))
+
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        ret = frozenset(elements(s))
+        with self._lock:
+            self.rebuilds += 1
+            # forget the elements computed for the previous bindings
+            previous = self._latest.pop(structure, None)
+            if previous in self._entries:
+                self.size -= len(self._entries.pop(previous))
+            if len(ret) <= self.maxsize:
+                self._entries[key] = ret
+                self._latest[structure] = key
+                self.size += len(ret)
+            while self.size > self.maxsize:
+                (old_structure, _), old = self._entries.popitem(last=False)
+                self._latest.pop(old_structure, None)
+                self.size -= len(old)
+                self.evictions += 1
+        return ret
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '%s(sets=%i, elements=%i, hits=%i, rebuilds=%i, evictions=%i)' % (
+            self.__class__.__name__, len(self), self.size, self.hits, self.rebuilds,
+            self.evictions)
+
+# cache used to materialize sets, if any
+materialization_cache = None
+
+def use_cache(cache):
+    """Materializes the elements of set comprehensions through ``cache``, or
+    without caching them if ``cache`` is None.
+    """
+    global materialization_cache
+    materialization_cache = cache
+
+def materialize(s):
+    """Returns the elements of the set comprehension ``s``, as a frozenset."""
+    if s.scope is None:
+        s = s()
+    if materialization_cache is not None:
+        return materialization_cache.get(s)
+    return frozenset(elements(s))
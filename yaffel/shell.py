@@ -15,22 +15,115 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from yaffel.parser import parse
-from yaffel.exceptions import EvaluationError
+from collections import ChainMap
+from yaffel import batch, parser
+from yaffel.parser import Prelude, compile, definition, fold_brackets, load_prelude, \
+                          share_prelude, tokenize
+from yaffel.exceptions import EvaluationError, UnboundValueError
+from yaffel.inference import infer, optimize, type_name
 from funcparserlib.parser import NoParseError
 
-import cmd, sys
+import cmd, pickle, sys, time
+
+class Session(object):
+    """Definitions bound in the shell with the `:let` command.
+
+    Definitions are compiled once, when they're bound, and shadow those of the
+    shared prelude for all the expressions evaluated afterwards. A session can
+    be saved to a snapshot holding its compiled definitions, so that it can be
+    loaded again without compiling them.
+    """
+
+    def __init__(self):
+        self.definitions = {}
+        self.sources = {}
+        self.types = {}
+        self._prelude = None
+        self._base = None
+
+    @property
+    def prelude(self):
+        # the session is rebuilt on top of the shared prelude, if it changed
+        if self._prelude is None or self._base is not parser.shared_prelude:
+            self._base = parser.shared_prelude
+            definitions = dict(self._base.definitions) if self._base is not None else {}
+            definitions.update(self.definitions)
+            self._prelude = Prelude(definitions, compiled=True)
+        return self._prelude
+
+    def define(self, source):
+        """Binds the definition `name = expression` of ``source``, and returns
+        the name it binds and its type.
+        """
+        try:
+            name, node = definition.parse(fold_brackets(tokenize(source)))
+        except NoParseError as e:
+            raise SyntaxError(e.msg)
+
+        scope = ChainMap({name: node}, self.prelude.definitions)
+        t = infer(node, scope)
+        self.definitions[name] = optimize(node, scope)
+        self.sources[name] = source.strip()
+        self.types[name] = t
+        self._prelude = None
+        return name, t
+
+    def drop(self, name):
+        if name not in self.definitions:
+            raise UnboundValueError("unbound variable '%s'" % name)
+        del self.definitions[name]
+        del self.sources[name]
+        del self.types[name]
+        self._prelude = None
+
+    def compile(self, source):
+        return compile(source, prelude=self.prelude)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump({'definitions': self.definitions, 'sources': self.sources,
+                         'types': self.types}, f)
+
+    def load(self, path):
+        """Replaces the definitions of the session by those of the snapshot at
+        ``path``. Snapshots are pickles, and should only be loaded from trusted
+        sources.
+        """
+        with open(path, 'rb') as f:
+            try:
+                snapshot = pickle.load(f)
+            except (EOFError, AttributeError, ImportError, IndexError) as e:
+                raise pickle.UnpicklingError(str(e))
+
+        # check the structure of the snapshot before replacing anything
+        keys = ('definitions', 'sources', 'types')
+        if not isinstance(snapshot, dict) or \
+           not all(isinstance(snapshot.get(k), dict) for k in keys) or \
+           not set(snapshot['definitions']) == set(snapshot['sources']) == set(snapshot['types']):
+            raise pickle.UnpicklingError("'%s' is not a session snapshot" % path)
+
+        self.definitions = snapshot['definitions']
+        self.sources = snapshot['sources']
+        self.types = snapshot['types']
+        self._prelude = None
 
 class Shell(cmd.Cmd):
     intro = 'Yaffel interpreter (version 0.1, June 2014), type Ctrl+D to exit'
     prompt = 'yaffel$ '
 
-    def parse(self, line):
+    def __init__(self, session=None):
+        super().__init__()
+        self.session = session or Session()
+
+    def attempt(self, line, action):
+        """Runs ``action``, reporting its errors, and returns 0 if it succeeded
+        or -1 otherwise. Commands don't return this status, as `cmd.Cmd` would
+        stop its loop on the first error.
+        """
         try:
-            t,v = parse(line)
-            print('\033[93m[%s]\033[0m %s' % (t.__name__, v))
+            action()
             return 0
-        except NoParseError as e:
+        except (NoParseError, SyntaxError) as e:
             print('\033[91mSyntax error: %s\033[0m' % e)
         except EvaluationError as e:
             print("\033[91mError while evaluating '%s': %s\033[0m" % (line, e))
@@ -38,26 +131,111 @@ class Shell(cmd.Cmd):
             print('\033[91mType inconsistency: %s\033[0m' % e)
         except ZeroDivisionError as e:
             print('\033[91mIllegal operation: Division by zero\033[0m')
+        except (OSError, pickle.UnpicklingError) as e:
+            print('\033[91mInvalid session file: %s\033[0m' % e)
         return -1
 
+    def parse(self, line):
+        def evaluate():
+            v = self.session.compile(line)()
+            print('\033[93m[%s]\033[0m %s' % (type(v).__name__, v))
+        return self.attempt(line, evaluate)
+
+    def do_let(self, arg):
+        """:let name = expression: binds a name for the rest of the session"""
+        def define():
+            name, t = self.session.define(arg)
+            print('\033[93m[%s]\033[0m %s' % (type_name(t) if t is not None else '?', name))
+        self.attempt(arg, define)
+
+    def do_defs(self, arg):
+        """:defs: lists the names bound in the session"""
+        for name in sorted(self.session.definitions):
+            t = self.session.types[name]
+            print('\033[93m[%s]\033[0m %s' % (type_name(t) if t is not None else '?',
+                                             self.session.sources[name]))
+
+    def do_drop(self, arg):
+        """:drop name [name ...]: unbinds names from the session"""
+        def drop():
+            for name in arg.split():
+                self.session.drop(name)
+        self.attempt(arg, drop)
+
+    def do_time(self, arg):
+        """:time expression: evaluates an expression and reports how long it took"""
+        def evaluate():
+            start = time.perf_counter()
+            expr = self.session.compile(arg)
+            compiled = time.perf_counter()
+            v = expr()
+            evaluated = time.perf_counter()
+            print('\033[93m[%s]\033[0m %s' % (type(v).__name__, v))
+            print('compiled in %.3f ms, evaluated in %.3f ms' %
+                  ((compiled - start) * 1000, (evaluated - compiled) * 1000))
+        self.attempt(arg, evaluate)
+
+    def do_save(self, arg):
+        """:save path: saves the definitions of the session to a snapshot"""
+        self.attempt(arg, lambda: self.session.save(arg.strip()))
+
+    def do_load(self, arg):
+        """:load path: replaces the definitions of the session by a snapshot"""
+        self.attempt(arg, lambda: self.session.load(arg.strip()))
+
+    def parseline(self, line):
+        # commands are prefixed by a colon, so that they don't hide the names
+        # bound in the session, and any other line is an expression
+        line = line.strip()
+        if line.startswith(':'):
+            return super().parseline(line[1:])
+        return None, None, line
+
+    def emptyline(self):
+        pass
+
     def default(self, line):
         if line == 'EOF':
             print('')
             exit(0)
         self.parse(line)
 
+USAGE = 'usage: shell.py [-p prelude] [-s session] [-e expression]'
+
 def main():
     shell = Shell()
+    argv = sys.argv[1:]
+
+    while argv and argv[0] in ('-p', '--prelude', '-s', '--session'):
+        if len(argv) < 2:
+            print('\033[91m%s\033[0m' % USAGE)
+            exit(-1)
+
+        if argv[0] in ('-p', '--prelude'):
+            # load the definitions shared by all the evaluated expressions
+            try:
+                share_prelude(load_prelude(argv[1]))
+            except (OSError, SyntaxError, EvaluationError, TypeError) as e:
+                print('\033[91mInvalid prelude: %s\033[0m' % e)
+                exit(-1)
+        elif shell.attempt(argv[1], lambda: shell.session.load(argv[1])) != 0:
+            # start from the definitions of a saved session
+            exit(-1)
+        argv = argv[2:]
+
+    # run a batch evaluation
+    if argv and argv[0] == 'batch':
+        exit(batch.main(argv[1:]))
 
     # parse the command line input
-    if len(sys.argv) > 1 and sys.argv[1] == '-e':
+    if argv and argv[0] == '-e':
         try:
-            exit(shell.default(sys.argv[2]))
+            exit(shell.parse(argv[1]))
         except IndexError:
-            print('\033[91musage: shell.py [-e expression]\033[0m') 
+            print('\033[91m%s\033[0m' % USAGE)
             exit(-1)
 
-    Shell().cmdloop()
+    shell.cmdloop()
 
 if __name__ == '__main__':
     main()